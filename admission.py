@@ -0,0 +1,129 @@
+import asyncio
+from collections import deque
+
+from starlette.responses import JSONResponse
+
+from cache import get_local_link
+from config import ADMISSION_LIMITS, ADMISSION_DEADLINES
+
+
+def parse_classes(value: str, cast):
+    """Разбирает настройку вида "redirect=256,write=32" в словарь."""
+    result = {}
+    for item in value.split(","):
+        name, _, number = item.partition("=")
+        result[name.strip()] = cast(number)
+    return result
+
+
+def route_class(method: str, path: str) -> str:
+    """Определяет класс маршрута: redirect, write, auth или read."""
+    if path.startswith("/auth/"):
+        return "auth"
+    if path.startswith("/links"):
+        if path == "/links/stats/batch":
+            return "read"
+        if method in ("POST", "PUT", "PATCH", "DELETE"):
+            return "write"
+        if method == "GET" and path.count("/") == 2:
+            return "redirect"
+    return "read"
+
+
+class Gate:
+    """Ограничитель параллельных запросов одного класса с очередью по времени."""
+
+    def __init__(self, limit: int, deadline: float):
+        self.limit = limit
+        self.deadline = deadline
+        self.active = 0
+        self.waiters = deque()
+        self.rejected = 0
+
+    async def acquire(self, wait: bool = True) -> bool:
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return True
+        if not wait:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.deadline)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот успели передать в момент истечения дедлайна
+                return True
+            self.rejected += 1
+            return False
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def release(self):
+        # Слот передаётся первому ожидающему, счётчик active не меняется
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": len(self.waiters),
+            "rejected": self.rejected,
+        }
+
+
+_deadlines = parse_classes(ADMISSION_DEADLINES, float)
+gates = {name: Gate(limit, _deadlines[name]) for name, limit in parse_classes(ADMISSION_LIMITS, int).items()}
+
+
+def admission_stats():
+    return {name: gate.stats() for name, gate in gates.items()}
+
+
+class AdmissionControlMiddleware:
+    """Ограничивает число одновременных запросов по классам маршрутов.
+
+    Запрос ждёт свободного слота не дольше дедлайна своего класса, затем
+    получает 503. Редиректы, найденные в локальном кеше воркера, не ждут
+    вовсе, а запросы на запись сбрасываются сразу, пока в очереди стоят
+    редиректы.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        kind = route_class(scope["method"], path)
+        if kind == "redirect" and get_local_link(path.rsplit("/", 1)[-1]) is not None:
+            await self.app(scope, receive, send)
+            return
+
+        gate = gates[kind]
+        wait = not (kind == "write" and gates["redirect"].waiters)
+        if not await gate.acquire(wait):
+            response = JSONResponse(
+                {"detail": "Сервер перегружен, повторите запрос позже"},
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
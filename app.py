@@ -1,23 +1,80 @@
+import asyncio
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+
 from fastapi import Query
-from models.models import Link
+from models.models import Link, LinkArchive, REDIRECT_TEMPORARY, REDIRECT_PERMANENT
 from auth.database import get_async_session
 from pydantic import BaseModel
-from typing import Optional
-from datetime import datetime
+from typing import Optional, List
+from datetime import date, datetime, timedelta
 import uuid
 from auth.database import User
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.responses import RedirectResponse
-from redis import asyncio as aioredis
+from cache import (
+    redis,
+    CachedLink,
+    get_cached_link,
+    set_cached_link,
+    update_cached_link,
+    invalidate_cached_link,
+    invalidate_cached_links,
+    listen_invalidations,
+    increase_link_counter,
+    cache_stats,
+    RedisUnavailable,
+)
 from auth.router import router as auth_router
-from auth.security import get_current_user_optional, current_active_user
-
-
-
-app = FastAPI()
+from auth.security import get_current_user_optional, current_active_user, current_superuser
+from config import RATE_LIMIT_SHORTEN, REDIRECT_MODE, REDIRECT_MAX_AGE, STATS_BATCH_LIMIT, UNIQUE_DAYS, TOPK_SIZE, BULK_CHUNK, SEARCH_PAGE_LIMIT, SEARCH_TIMEOUT_MS, CAPTURE_PATH
+from ratelimit import RateLimit
+from admission import AdmissionControlMiddleware, admission_stats
+from snapshot import lookup_url
+from clicks import record_click, start_click_workers, stop_click_workers, click_stats, count_uniques, drop_link_stats
+from archive import promote_link, run_archiver
+from topk import get_top
+from profiling import ProfilingMiddleware, router as profiling_router
+from capture import CaptureMiddleware, start_capture, stop_capture, capture_stats
+from idempotency import idempotent
+from usage import add_links, remove_links, track_expiry, untrack_expiry, run_usage_reconciler
+from logs import AccessLogMiddleware, setup_logging, start_logging, stop_logging, logging_stats
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_logging()
+    invalidation_listener = asyncio.create_task(listen_invalidations())
+    start_click_workers()
+    archiver = asyncio.create_task(run_archiver())
+    start_capture()
+    usage_reconciler = asyncio.create_task(run_usage_reconciler())
+    yield
+    usage_reconciler.cancel()
+    invalidation_listener.cancel()
+    archiver.cancel()
+    await stop_click_workers()
+    stop_capture()
+    stop_logging()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(AdmissionControlMiddleware)
+app.add_middleware(AccessLogMiddleware)
+if CAPTURE_PATH:
+    # Снаружи всех остальных, чтобы в журнал попадали и отклонённые запросы
+    app.add_middleware(CaptureMiddleware)
 
 app.include_router(auth_router)
+app.include_router(profiling_router)
 
 
 
@@ -34,94 +91,164 @@ class LinkResponse(BaseModel):
     short_code: str
     original_url: str
     owner_id: Optional[int] = None
+    redirect_type: str = REDIRECT_TEMPORARY
 
 class ErrorResponse(BaseModel):
     detail: str
 
+
+class StatsBatchRequest(BaseModel):
+    short_codes: List[str]
+
+
+# Отбор ссылок владельца для массовых операций: список кодов и/или фильтр
+class BulkFilter(BaseModel):
+    short_codes: Optional[List[str]] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    url_prefix: Optional[str] = None
+
+
+class BulkRebindRequest(BulkFilter):
+    new_url: str
+
 # Генерация уникального короткого кода
 def generate_short_code():
     return str(uuid.uuid4())[:8]
 
 
+# Постоянный редирект кешируется браузером и CDN, но не дольше срока жизни ссылки
+def link_redirect(link: CachedLink) -> RedirectResponse:
+    if not link.permanent:
+        return RedirectResponse(url=link.original_url, status_code=307)
+    max_age = REDIRECT_MAX_AGE
+    if link.expires_at:
+        max_age = max(0, min(max_age, int(link.expires_at - time.time())))
+    return RedirectResponse(
+        url=link.original_url,
+        status_code=308,
+        headers={"Cache-Control": f"public, max-age={max_age}"},
+    )
+
 
+
+from sqlalchemy import String, any_, bindparam, delete, literal, union_all, update, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.future import select
 
 current_user = get_current_user_optional
 
+
+# Код занят, если он есть в link или в архиве холодных ссылок
+async def short_code_taken(db: AsyncSession, short_code: str) -> bool:
+    result = await db.execute(
+        select(Link.id).filter_by(short_code=short_code)
+        .union_all(select(LinkArchive.id).filter_by(short_code=short_code))
+        .limit(1)
+    )
+    return result.first() is not None
+
+
+# Ссылка из link, а если её там нет — из архива холодных ссылок.
+# Поля у Link и LinkArchive одинаковые, поэтому вызывающему коду всё равно, откуда строка
+async def find_link(db: AsyncSession, short_code: str):
+    result = await db.execute(select(Link).filter_by(short_code=short_code))
+    link = result.scalar_one_or_none()
+    if link is None:
+        result = await db.execute(select(LinkArchive).filter_by(short_code=short_code))
+        link = result.scalar_one_or_none()
+    return link
+
+
 async def get_optional_user(user: Optional[User] = Depends(current_user, use_cache=True)) -> Optional[User]:
     return user
 
-@app.post("/links/shorten", response_model=LinkResponse)
+@app.post("/links/shorten", response_model=LinkResponse, dependencies=[Depends(RateLimit("shorten", RATE_LIMIT_SHORTEN))])
 async def shorten_link(
     original_url: str = Query(..., description="Оригинальный URL"),
     custom_alias: Optional[str] = Query(None, description="Пользовательский короткий код"),
+    permanent: bool = Query(False, description="Постоянный редирект 308 с кешированием, ссылку нельзя будет перепривязать"),
+    idempotency_key: Optional[str] = Header(None, max_length=255, description="Повтор с тем же ключом вернёт первый ответ"),
     db: AsyncSession = Depends(get_async_session),
     user: Optional[User] = Depends(get_optional_user)
 ):
-    short_code = custom_alias or generate_short_code()
+    owner_id = user.id if user else None
+    redirect_type = REDIRECT_PERMANENT if permanent else REDIRECT_TEMPORARY
 
-    # Проверяем, существует ли уже этот alias
-    result = await db.execute(select(Link).filter_by(short_code=short_code))
-    existing_link = result.scalars().first()
+    async def create():
+        short_code = custom_alias or generate_short_code()
 
-    if existing_link:
-        raise HTTPException(status_code=400, detail="Alias уже существует")
+        # Проверяем, существует ли уже этот alias
+        if await short_code_taken(db, short_code):
+            raise HTTPException(status_code=400, detail="Alias уже существует")
 
-    owner_id = user.id if user else None
-    new_link = Link(short_code=short_code, original_url=original_url, owner_id=owner_id)
+        new_link = Link(
+            short_code=short_code,
+            original_url=original_url,
+            owner_id=owner_id,
+            redirect_type=redirect_type,
+            created_at=datetime.utcnow(),
+        )
 
-    db.add(new_link)
-    await db.commit()
-    await db.refresh(new_link)
+        db.add(new_link)
+        await add_links(db, owner_id)
+        await db.commit()
+        await db.refresh(new_link)
+        await set_cached_link(short_code, CachedLink.from_link(new_link))
 
-    return {"short_code": short_code, "original_url": original_url, "owner_id": owner_id}
+        return {"short_code": short_code, "original_url": original_url, "owner_id": owner_id, "redirect_type": redirect_type}
+
+    return await idempotent(idempotency_key, owner_id, [original_url, custom_alias, permanent], create)
 
 
 
 # Создание короткой ссылки с временем жизни
-@app.post("/links/shorten/time")
-async def shorten_link_with_time(original_url: str, custom_alias: Optional[str] = None, expires_at: Optional[datetime] = None, db: AsyncSession = Depends(get_async_session)):
+@app.post("/links/shorten/time", dependencies=[Depends(RateLimit("shorten_time", RATE_LIMIT_SHORTEN))])
+async def shorten_link_with_time(original_url: str, custom_alias: Optional[str] = None, expires_at: Optional[datetime] = None, permanent: bool = False, db: AsyncSession = Depends(get_async_session), user: Optional[User] = Depends(get_optional_user)):
     short_code = custom_alias or str(uuid.uuid4())[:8]
-    existing_link = await db.execute(select(Link).filter_by(short_code = short_code))
-    if existing_link:
+    if await short_code_taken(db, short_code):
         raise HTTPException(status_code=400, detail="Short code already exists")
-    link = Link(short_code=short_code, original_url=original_url, expires_at=expires_at)
+    owner_id = user.id if user else None
+    redirect_type = REDIRECT_PERMANENT if permanent else REDIRECT_TEMPORARY
+    link = Link(
+        short_code=short_code,
+        original_url=original_url,
+        expires_at=expires_at,
+        owner_id=owner_id,
+        redirect_type=redirect_type,
+        created_at=datetime.utcnow(),
+    )
     db.add(link)
+    await add_links(db, owner_id)
     await db.commit()
     await db.refresh(link)
-    return {"short_code": short_code, "original_url": original_url, "expires_at": expires_at}
-
-from sqlalchemy.future import select
-
-redis = aioredis.from_url("redis://localhost", encoding="utf8", decode_responses=True)
+    await set_cached_link(short_code, CachedLink.from_link(link))
+    await track_expiry(owner_id, short_code, expires_at)
+    return {"short_code": short_code, "original_url": original_url, "expires_at": expires_at, "owner_id": owner_id, "redirect_type": redirect_type}
 
 POPULARITY_THRESHOLD = 3  # Число запросов для кеширования
-CACHE_EXPIRE = 60  # Время жизни кеша (сек)
-
-async def get_cached_url(short_code: str):
-    return await redis.get(f"short_url:{short_code}")
-
-async def set_cached_url(short_code: str, original_url: str):
-    await redis.set(f"short_url:{short_code}", original_url, ex=CACHE_EXPIRE)
-
-async def increase_link_counter(short_code: str):
-    return await redis.incr(f"short_url_count:{short_code}")
-
-async def get_link_counter(short_code: str):
-    count = await redis.get(f"short_url_count:{short_code}")
-    return int(count) if count else 0
 
 @app.get("/links/{short_code}", responses={
     307: {"description": "Успешный ответ"},
+    308: {"description": "Постоянная ссылка, ответ можно кешировать"},
     404: {
         "description": "Ссылка не найдена",
         "model": ErrorResponse
     },
 })
-async def redirect_to_url(short_code: str, db: AsyncSession = Depends(get_async_session)):
-    cached_url = await get_cached_url(short_code)
-    if cached_url:
-        return RedirectResponse(url=cached_url, status_code=307)
+async def redirect_to_url(short_code: str, request: Request, db: AsyncSession = Depends(get_async_session)):
+    # Режим без БД: ссылки берутся только из снимка
+    if REDIRECT_MODE == "snapshot":
+        original_url = lookup_url(short_code)
+        if not original_url:
+            raise HTTPException(status_code=404, detail="Ссылка не найдена")
+        return RedirectResponse(url=original_url, status_code=307)
+
+    cached_link = await get_cached_link(short_code)
+    if cached_link:
+        record_click(request, short_code)
+        return link_redirect(cached_link)
 
     # Увеличиваем счетчик запросов
     count = await increase_link_counter(short_code)
@@ -129,20 +256,35 @@ async def redirect_to_url(short_code: str, db: AsyncSession = Depends(get_async_
     # Запрос в БД, если ссылки нет в кеше
     result = await db.execute(select(Link).filter_by(short_code=short_code))
     link = result.scalar_one_or_none()
+    if not link:
+        # Ссылка могла уйти в архив холодных ссылок: возвращаем её в link
+        link = await promote_link(db, short_code)
     if not link:
         raise HTTPException(status_code=404, detail="Ссылка не найдена")
 
     # Если ссылка стала популярной, кешируем ее
+    cached_link = CachedLink.from_link(link)
     if count >= POPULARITY_THRESHOLD:
-        await set_cached_url(short_code, link.original_url)
+        await set_cached_link(short_code, cached_link)
 
-    return RedirectResponse(url=link.original_url, status_code=307)
+    record_click(request, short_code)
+    return link_redirect(cached_link)
+
+# Состояние кеша, предохранителя Redis, контроля допуска и очереди переходов для мониторинга
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        "redis": cache_stats(),
+        "admission": admission_stats(),
+        "clicks": click_stats(),
+        "capture": capture_stats(),
+        "logging": logging_stats(),
+    }
 
 # 🗑️ DELETE /links/{short_code} – Удалить короткую ссылку
 @app.delete("/links/{short_code}")
 async def delete_link(short_code: str, db: AsyncSession = Depends(get_async_session),  user: User = Depends(current_active_user)):
-    result = await db.execute(select(Link).filter_by(short_code = short_code))
-    link = result.scalar_one_or_none()
+    link = await find_link(db, short_code)
     if user is None:
         raise HTTPException(status_code=401, detail="Требуется аутентификация")
     if not link:
@@ -152,7 +294,11 @@ async def delete_link(short_code: str, db: AsyncSession = Depends(get_async_sess
     if link.owner_id != user.id:
         raise HTTPException(status_code=403, detail="Недостаточно прав для удаления")
     await db.delete(link)
+    await remove_links(db, link.owner_id, 1, link.visits or 0)
     await db.commit()
+    await invalidate_cached_link(short_code)
+    await untrack_expiry(link.owner_id, [short_code])
+    await drop_link_stats([short_code])
     return {"message": "Ссылка успешно удалена"}
 
 @app.put("/links/{short_code}/update-url", response_model=LinkResponse)
@@ -163,8 +309,7 @@ async def rebind_link(
     user: User = Depends(get_optional_user)
 ):
     # Ищем существующую короткую ссылку
-    result = await db.execute(select(Link).filter_by(short_code=short_code))
-    existing_link = result.scalar_one_or_none()
+    existing_link = await find_link(db, short_code)
 
     if not existing_link:
         raise HTTPException(status_code=404, detail="Ссылка не найдена")
@@ -172,42 +317,289 @@ async def rebind_link(
     if existing_link.owner_id != user.id:
         raise HTTPException(status_code=403, detail="Недостаточно прав")
 
+    # Постоянный редирект уже мог закешироваться у клиентов и в CDN
+    if existing_link.redirect_type == REDIRECT_PERMANENT:
+        raise HTTPException(status_code=409, detail="Постоянную ссылку нельзя перепривязать")
+
     # Обновляем длинную ссылку
     existing_link.original_url = new_url
 
     await db.commit()
     await db.refresh(existing_link)
+    await update_cached_link(short_code, CachedLink.from_link(existing_link))
 
     return LinkResponse(
         short_code=existing_link.short_code,
         original_url=existing_link.original_url,
-        owner_id=existing_link.owner_id
+        owner_id=existing_link.owner_id,
+        redirect_type=existing_link.redirect_type
     )
 
 
+def bulk_conditions(model, request: BulkFilter, owner_id: int) -> list:
+    if request.short_codes is None and not (request.created_from or request.created_to or request.url_prefix):
+        raise HTTPException(status_code=400, detail="Укажите short_codes или фильтр")
+    conditions = [model.owner_id == owner_id]
+    if request.created_from:
+        conditions.append(model.created_at >= request.created_from)
+    if request.created_to:
+        conditions.append(model.created_at < request.created_to)
+    if request.url_prefix:
+        conditions.append(model.original_url.startswith(request.url_prefix, autoescape=True))
+    return conditions
+
+
+async def bulk_chunks(
+    db: AsyncSession,
+    model,
+    statement,
+    conditions: list,
+    short_codes: Optional[List[str]],
+    before_commit=None,
+):
+    """Выполняет DELETE/UPDATE ... RETURNING short_code, visits пачками по BULK_CHUNK.
+
+    Каждая пачка — отдельная транзакция, чтобы не держать блокировки на
+    всём наборе; before_commit(rows) выполняется внутри неё. Отдаёт строки,
+    затронутые очередной пачкой.
+    """
+    statement = statement.returning(model.short_code, model.visits).execution_options(synchronize_session=False)
+
+    async def run(chunk_statement):
+        rows = (await db.execute(chunk_statement)).all()
+        if before_commit is not None:
+            await before_commit(rows)
+        await db.commit()
+        return rows
+
+    if short_codes is not None:
+        short_codes = list(dict.fromkeys(short_codes))
+        for start in range(0, len(short_codes), BULK_CHUNK):
+            codes = bindparam("codes", short_codes[start:start + BULK_CHUNK], type_=postgresql.ARRAY(String))
+            yield await run(statement.where(*conditions, model.short_code == any_(codes)))
+        return
+
+    # Обработанные строки перестают подходить под условия, поэтому берём следующую пачку с начала
+    while True:
+        batch = select(model.id).where(*conditions).limit(BULK_CHUNK)
+        rows = await run(statement.where(model.id.in_(batch)))
+        yield rows
+        if len(rows) < BULK_CHUNK:
+            return
+
+
+# Массовое удаление ссылок владельца, включая ушедшие в архив
+@app.post("/links/bulk/delete")
+async def bulk_delete_links(
+    request: BulkFilter,
+    db: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_user),
+):
+    async def update_usage(rows):
+        await remove_links(db, user.id, len(rows), sum(row.visits or 0 for row in rows))
+
+    deleted = 0
+    for model in (Link, LinkArchive):
+        conditions = bulk_conditions(model, request, user.id)
+        chunks = bulk_chunks(db, model, delete(model), conditions, request.short_codes, update_usage)
+        async for rows in chunks:
+            short_codes = [row.short_code for row in rows]
+            deleted += len(short_codes)
+            # Архивные ссылки тоже бывают в кеше: их кладёт туда rebind_link
+            await invalidate_cached_links(short_codes)
+            await untrack_expiry(user.id, short_codes)
+            await drop_link_stats(short_codes)
+    return {"deleted": deleted}
+
+
+# Массовая перепривязка; постоянные ссылки не меняются, как и в rebind_link
+@app.post("/links/bulk/update-url")
+async def bulk_rebind_links(
+    request: BulkRebindRequest,
+    db: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_user),
+):
+    updated = 0
+    for model in (Link, LinkArchive):
+        conditions = bulk_conditions(model, request, user.id) + [
+            model.redirect_type != REDIRECT_PERMANENT,
+            model.original_url.is_distinct_from(request.new_url),
+        ]
+        statement = update(model).values(original_url=request.new_url)
+        async for rows in bulk_chunks(db, model, statement, conditions, request.short_codes):
+            updated += len(rows)
+            await invalidate_cached_links([row.short_code for row in rows], drop_counters=False)
+    return {"updated": updated}
+
+
 # Статистика по ссылке
 @app.get("/links/{short_code}/stats")
 async def get_link_stats(short_code: str, db: AsyncSession = Depends(get_async_session)):
-    result = await db.execute(select(Link).filter_by(short_code = short_code))
-    link = result.scalar_one_or_none()
+    link = await find_link(db, short_code)
     if not link:
         raise HTTPException(status_code=404, detail="Link not found")
+    try:
+        unique_visitors = await count_uniques(short_code)
+    except RedisUnavailable:
+        unique_visitors = None
     return {
         "original_url": link.original_url,
         "created_at": link.created_at,
         "visits": link.visits,
-        "last_visited": link.last_visited
+        "last_visited": link.last_visited,
+        "unique_visitors": unique_visitors,
     }
 
 
+# Уникальные посетители за диапазон дней (UTC), по умолчанию за последнюю неделю
+@app.get("/links/{short_code}/stats/uniques")
+async def get_link_uniques(
+    short_code: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_session),
+):
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=6)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start позже end")
+    if (end - start).days >= UNIQUE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Диапазон не больше {UNIQUE_DAYS} дней")
+
+    if not await short_code_taken(db, short_code):
+        raise HTTPException(status_code=404, detail="Link not found")
+    try:
+        unique_visitors = await count_uniques(short_code, start, end)
+    except RedisUnavailable:
+        raise HTTPException(status_code=503, detail="Статистика временно недоступна")
+    return {"short_code": short_code, "start": start, "end": end, "unique_visitors": unique_visitors}
+
+
+# Топ рефереров и стран; count может быть завышен не больше чем на error
+@app.get("/links/{short_code}/stats/top")
+async def get_link_top(
+    short_code: str,
+    limit: int = Query(10, ge=1, le=TOPK_SIZE),
+    db: AsyncSession = Depends(get_async_session),
+):
+    if not await short_code_taken(db, short_code):
+        raise HTTPException(status_code=404, detail="Link not found")
+    try:
+        top = await get_top(short_code, limit)
+    except RedisUnavailable:
+        raise HTTPException(status_code=503, detail="Статистика временно недоступна")
+    return {"short_code": short_code, "referrers": top["ref"], "countries": top["country"]}
+
+
+# Статистика сразу по многим ссылкам: один запрос в БД и один MGET счётчиков
+@app.post("/links/stats/batch")
+async def get_links_stats_batch(request: StatsBatchRequest, db: AsyncSession = Depends(get_async_session)):
+    short_codes = list(dict.fromkeys(request.short_codes))
+    if len(short_codes) > STATS_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Не больше {STATS_BATCH_LIMIT} кодов за запрос")
+
+    codes = bindparam("codes", short_codes, type_=postgresql.ARRAY(String))
+    result = await db.execute(
+        select(Link.short_code, Link.original_url, Link.created_at, Link.visits, Link.last_visited)
+        .where(Link.short_code == any_(codes))
+        .union_all(
+            select(LinkArchive.short_code, LinkArchive.original_url, LinkArchive.created_at,
+                   LinkArchive.visits, LinkArchive.last_visited)
+            .where(LinkArchive.short_code == any_(codes))
+        )
+    )
+    rows = {row.short_code: row for row in result}
+
+    # Счётчики промахов кеша из Redis (short_url_count, не переходы: переходы — visits).
+    # Без Redis — null, чтобы сбой не выглядел как нулевые данные
+    try:
+        counters = [int(counter) if counter else 0
+                    for counter in await redis.mget([f"short_url_count:{code}" for code in rows])]
+    except RedisUnavailable:
+        counters = [None] * len(rows)
+
+    links = {}
+    for (code, row), counter in zip(rows.items(), counters):
+        links[code] = {
+            "original_url": row.original_url,
+            "created_at": row.created_at,
+            "visits": row.visits,
+            "last_visited": row.last_visited,
+            "cache_misses": counter,
+        }
+    return {"links": links, "missing": [code for code in short_codes if code not in rows]}
+
+
 # Поиск по оригинальному URL
 @app.get("/links/url/search")
 async def search_link(original_url: str, db: AsyncSession = Depends(get_async_session)):
-    print(original_url)
-    result = await db.execute(select(Link).filter_by(original_url=original_url))
-    print(f"Поиск ссылки с оригинальным URL: {original_url}")
-    link = result.scalars().first()
+    result = await db.execute(
+        select(Link.short_code).filter_by(original_url=original_url)
+        .union_all(select(LinkArchive.short_code).filter_by(original_url=original_url))
+        .limit(1)
+    )
+    link = result.first()
     if not link:
-        print(f"Ссылка не найдена: {original_url}")
+        logger.info("link not found", extra={"original_url": original_url})
         raise HTTPException(status_code=404, detail="Link not found")
     return {"short_code": link.short_code}
+
+
+# SQLSTATE query_canceled: запрос прерван по statement_timeout
+QUERY_CANCELED = "57014"
+
+
+def url_match_condition(model, mode: str, q: str):
+    """Условие поиска по model.original_url; все режимы используют триграммный GIN-индекс."""
+    if mode == "substring":
+        return model.original_url.icontains(q, autoescape=True)
+    if mode == "prefix":
+        # Схему можно не указывать: "example.com/campaign" найдёт и http, и https
+        pattern = re.escape(q) if "://" in q else r"([a-z][a-z0-9+.-]*://)?" + re.escape(q)
+        return model.original_url.regexp_match("^" + pattern, flags="i")
+    host = re.sub(r"^[a-z][a-z0-9+.-]*://", "", q.lower()).split("/")[0]
+    # Домен и все его поддомены, с портом или без
+    pattern = r"^[a-z][a-z0-9+.-]*://([^/@]*@)?([^/]*\.)?" + re.escape(host) + r"(:[0-9]+)?([/?#]|$)"
+    return model.original_url.regexp_match(pattern, flags="i")
+
+
+# Поиск ссылок по префиксу, домену или подстроке URL для поддержки, включая архив.
+# Постраничный вывод по id: следующую страницу запрашивают с after=next.
+# id у link и link_archive общие, поэтому одна страница сливает обе таблицы по id
+@app.get("/links/url/matches")
+async def search_links(
+    q: str = Query(..., min_length=3),
+    mode: str = Query("substring", pattern="^(prefix|domain|substring)$"),
+    limit: int = Query(50, ge=1, le=SEARCH_PAGE_LIMIT),
+    after: int = 0,
+    db: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_superuser),
+):
+    def matches(model):
+        return (
+            select(model.id, model.short_code, model.original_url, model.owner_id, model.created_at,
+                   literal(model is LinkArchive).label("archived"))
+            .where(url_match_condition(model, mode, q), model.id > after)
+            .order_by(model.id)
+            .limit(limit)
+        )
+
+    found = union_all(matches(Link), matches(LinkArchive)).subquery()
+    query = select(found).order_by(found.c.id).limit(limit)
+    try:
+        await db.execute(text(f"SET LOCAL statement_timeout = {SEARCH_TIMEOUT_MS}"))
+        rows = (await db.execute(query)).all()
+    except DBAPIError as exc:
+        await db.rollback()
+        # Остальные ошибки БД — не перегрузка поиска, их не прячем за 503
+        if getattr(exc.orig, "sqlstate", None) != QUERY_CANCELED:
+            raise
+        raise HTTPException(status_code=503, detail="Поиск не уложился в лимит времени, уточните запрос")
+    await db.commit()
+
+    links = [
+        {"short_code": row.short_code, "original_url": row.original_url, "owner_id": row.owner_id,
+         "created_at": row.created_at, "archived": row.archived}
+        for row in rows
+    ]
+    return {"links": links, "next": rows[-1].id if len(rows) == limit else None}
@@ -2,4 +2,4 @@ alembic upgrade head
 
 pytest -v functionaltests.py -p pytest_asyncio
 
-gunicorn app:app --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind=0.0.0.0:8000
\ No newline at end of file
+python main.py --workers 4 --bind=0.0.0.0:8000
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""Перенос холодных ссылок из link в link_archive и обратно.
+
+Ссылки, по которым не переходили ARCHIVE_AFTER_DAYS дней (или созданные
+так давно и ни разу не открытые), переносятся в архив пачками. Редирект при
+промахе в link ищет код в архиве и возвращает ссылку в горячую таблицу.
+
+Однократный запуск:
+    python archive.py --days 30
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from auth.database import async_session_maker
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL, ARCHIVE_BATCH
+from models.models import Link
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = "id, short_code, original_url, created_at, visits, last_visited, expires_at, owner_id, redirect_type"
+
+# Блокировка на время транзакции, чтобы архивацией занимался один воркер
+ARCHIVE_LOCK_SQL = text("SELECT pg_try_advisory_xact_lock(hashtext('link_archive'))")
+
+ARCHIVE_BATCH_SQL = text(f"""
+WITH moved AS (
+    DELETE FROM link WHERE id IN (
+        SELECT id FROM link
+        WHERE coalesce(last_visited, created_at) < :cutoff
+        LIMIT :batch
+    )
+    RETURNING {COLUMNS}
+)
+INSERT INTO link_archive ({COLUMNS}, archived_at)
+SELECT {COLUMNS}, now() AT TIME ZONE 'utc' FROM moved
+""")
+
+PROMOTE_SQL = text(f"""
+WITH restored AS (
+    DELETE FROM link_archive WHERE short_code = :short_code
+    RETURNING {COLUMNS}
+)
+INSERT INTO link ({COLUMNS})
+SELECT {COLUMNS} FROM restored
+""")
+
+
+async def archive_cold_links(days: int = ARCHIVE_AFTER_DAYS) -> int:
+    """Переносит в архив ссылки без переходов за days дней, возвращает их число."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    total = 0
+    while True:
+        async with async_session_maker() as session:
+            if not (await session.execute(ARCHIVE_LOCK_SQL)).scalar():
+                return total
+            result = await session.execute(ARCHIVE_BATCH_SQL, {"cutoff": cutoff, "batch": ARCHIVE_BATCH})
+            await session.commit()
+        total += result.rowcount
+        if result.rowcount < ARCHIVE_BATCH:
+            return total
+
+
+async def promote_link(db: AsyncSession, short_code: str) -> Optional[Link]:
+    """Возвращает ссылку из архива в link; None, если в архиве её нет."""
+    try:
+        result = await db.execute(PROMOTE_SQL, {"short_code": short_code})
+        await db.commit()
+    except IntegrityError:
+        # Код уже вернул в link параллельный запрос
+        await db.rollback()
+    else:
+        if not result.rowcount:
+            return None
+    result = await db.execute(select(Link).filter_by(short_code=short_code))
+    return result.scalar_one_or_none()
+
+
+async def run_archiver():
+    """Фоновая задача: периодически переносит холодные ссылки в архив."""
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+        try:
+            moved = await archive_cold_links()
+        except Exception:
+            # Следующая попытка будет через ARCHIVE_INTERVAL
+            logger.exception("link archiving failed")
+        else:
+            logger.info("links archived", extra={"count": moved})
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Перенос холодных ссылок в link_archive")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS)
+    args = parser.parse_args()
+    print(f"перенесено ссылок: {asyncio.run(archive_cold_links(args.days))}")
+
+
+if __name__ == "__main__":
+    main()
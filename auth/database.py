@@ -1,20 +1,21 @@
+import logging
 from typing import AsyncGenerator
 from datetime import datetime
 
-from fastapi import Depends
-from  fastapi_users.db import SQLAlchemyBaseUserTable, SQLAlchemyUserDatabase
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy import Boolean, String, Integer, TIMESTAMP, ForeignKey
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped, mapped_column
-from config import  DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER
+from config import  DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER, SQL_ECHO
 
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 class Base(DeclarativeBase):
     pass
 
-class User(SQLAlchemyBaseUserTable[int], Base):
+class User(Base):
+    __tablename__ = "user"
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     username: Mapped[str] = mapped_column(String, nullable=False)
     email: Mapped[str] = mapped_column(
@@ -29,12 +30,13 @@ class User(SQLAlchemyBaseUserTable[int], Base):
     is_verified: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
 
 
-engine = create_async_engine(DATABASE_URL, echo = True)
+engine = create_async_engine(DATABASE_URL)
+if SQL_ECHO:
+    # echo=True повесил бы на движок синхронный StreamHandler в stdout;
+    # уровень логгера отправляет запросы в общую очередь логов (logs.py)
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
-        yield session
-
-async def get_user_db(session: AsyncSession = Depends(get_async_session)):
-    yield SQLAlchemyUserDatabase(session, User)
\ No newline at end of file
+        yield session
\ No newline at end of file
@@ -1,20 +1,25 @@
+import logging
 import uuid
 from typing import Optional
 
 from fastapi import Depends, Request
 from fastapi_users import BaseUserManager, UUIDIDMixin
+from fastapi_users.db import SQLAlchemyUserDatabase
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from auth.database import User, get_user_db
+from auth.database import User, get_async_session
 
 SECRET = "SECRET"
 
+logger = logging.getLogger(__name__)
+
 
 class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     reset_password_token_secret = SECRET
     verification_token_secret = SECRET
 
     async def on_after_register(self, user: User, request: Optional[Request] = None):
-        print(f"User {user.id} has registered.")
+        logger.info("user registered", extra={"user_id": user.id})
 
         # async def on_after_forgot_password(
         #     self, user: User, token: str, request: Optional[Request] = None
@@ -27,5 +32,9 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
         #     print(f"Verification requested for user {user.id}. Verification token: {token}")
 
 
+async def get_user_db(session: AsyncSession = Depends(get_async_session)):
+    yield SQLAlchemyUserDatabase(session, User)
+
+
 async def get_user_manager(user_db=Depends(get_user_db)):
     yield UserManager(user_db)
\ No newline at end of file
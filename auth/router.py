@@ -12,12 +12,16 @@ from auth.security import (
     CurrentUser,
     Token,
     ACCESS_TOKEN_EXPIRE_MINUTES,
-    pwd_context,
+    get_pwd_context,
 )
+from config import RATE_LIMIT_AUTH
+from ratelimit import RateLimit
+from usage import get_usage
+
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
-@router.post("/token", response_model=Token)
+@router.post("/token", response_model=Token, dependencies=[Depends(RateLimit("token", RATE_LIMIT_AUTH))])
 async def login_for_access_token(
         form_data: OAuth2PasswordRequestForm = Depends(),
         session: AsyncSession = Depends(get_async_session)
@@ -53,7 +57,7 @@ async def register(
             detail="Username or email already registered"
         )
 
-    hashed_password = pwd_context.hash(password)
+    hashed_password = get_pwd_context().hash(password)
     new_user = User(
         username=username,
         email=email,
@@ -69,6 +73,15 @@ async def register(
     return {"message": "User created successfully"}
 
 
+@router.get("/me/usage")
+async def read_users_me_usage(
+        current_user: CurrentUser,
+        session: AsyncSession = Depends(get_async_session)
+):
+    # Готовые счётчики из owner_usage вместо COUNT/SUM по link
+    return await get_usage(session, current_user.id)
+
+
 @router.get("/me")
 async def read_users_me(current_user: CurrentUser):
     return {
@@ -1,11 +1,11 @@
 # auth/security.py
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional, Annotated
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 import jwt
 from jwt import PyJWTError as JWTError
-from passlib.context import CryptContext
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
@@ -18,7 +18,6 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24
 
 # Инициализация компонентов безопасности
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 
@@ -49,6 +48,14 @@ async def get_current_user_optional(
     return user if user else None
 
 
+@lru_cache
+def get_pwd_context():
+    # passlib загружается при первой проверке пароля, а не при старте воркера
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -71,7 +78,7 @@ async def authenticate_user(
     user = await get_user(username, session)
     if not user:
         return False
-    if not pwd_context.verify(password, user.hashed_password):
+    if not get_pwd_context().verify(password, user.hashed_password):
         return False
     return user
 
@@ -133,4 +140,10 @@ async def current_active_user(
     if not user.is_active:
         raise HTTPException(status_code=403, detail="Inactive user")
 
-    return user
\ No newline at end of file
+    return user
+
+
+async def current_superuser(user: User = Depends(current_active_user)) -> User:
+    if not user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not enough privileges")
+    return user
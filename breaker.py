@@ -0,0 +1,68 @@
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Предохранитель для внешнего сервиса.
+
+    После failure_threshold ошибок подряд размыкается и reset_timeout секунд
+    не пропускает вызовы. Затем пропускает один пробный вызов: успех замыкает
+    цепь (и вызывает on_recover), ошибка снова размыкает её.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, on_recover=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_recover = on_recover
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.transitions = deque(maxlen=20)
+
+    def _set_state(self, state: str):
+        self.transitions.append({"from": self.state, "to": state, "at": time.time()})
+        self.state = state
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.probing = False
+        if self.state != CLOSED:
+            self._set_state(CLOSED)
+            if self.on_recover:
+                self.on_recover()
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self._set_state(OPEN)
+            self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """Пробный вызов прервался без ответа (отмена): следующий вызов попробует снова."""
+        self.probing = False
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "state": self.state,
+            "failures": self.failures,
+            "transitions": list(self.transitions),
+        }
@@ -0,0 +1,281 @@
+import asyncio
+import calendar
+import json
+import time
+from collections import OrderedDict, Counter
+from typing import NamedTuple, Optional
+
+from redis import asyncio as aioredis
+from sqlalchemy.future import select
+
+from auth.database import async_session_maker
+from config import (
+    REDIS_NODES,
+    REDIS_VNODES,
+    REDIS_TIMEOUT,
+    REDIS_BREAKER_FAILURES,
+    REDIS_BREAKER_RESET,
+    CACHE_EXPIRE,
+    CACHE_SOFT_EXPIRE,
+    CACHE_REFRESH_LOCK,
+    LOCAL_CACHE_SIZE,
+    LOCAL_CACHE_EXPIRE,
+)
+from models.models import Link, REDIRECT_PERMANENT
+from sharding import ShardedRedis, RedisUnavailable
+
+INVALIDATE_CHANNEL = "short_url_invalidate"
+
+# Локальный кеш воркера: short_code -> (CachedLink, deadline)
+_local: OrderedDict = OrderedDict()
+
+# Короткие коды, которые этот воркер уже обновляет в фоне
+_refreshing: set = set()
+_refresh_tasks: set = set()
+
+# Изменения, накопленные пока Redis недоступен
+_pending_counts: Counter = Counter()
+_pending_invalidations: set = set()
+
+
+def _on_recover():
+    task = asyncio.create_task(_flush_pending())
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+# Команды к каждому узлу идут через его предохранитель, ошибки приходят как RedisUnavailable
+redis = ShardedRedis(
+    REDIS_NODES,
+    REDIS_VNODES,
+    REDIS_TIMEOUT,
+    REDIS_BREAKER_FAILURES,
+    REDIS_BREAKER_RESET,
+    on_recover=_on_recover,
+)
+
+# Подписка ждёт сообщений дольше таймаута команд, поэтому у неё своё соединение
+pubsub_redis = aioredis.from_url(redis.node(INVALIDATE_CHANNEL).url, encoding="utf8", decode_responses=True)
+
+
+class CachedLink(NamedTuple):
+    """То, что нужно для редиректа без обращения к БД."""
+    original_url: str
+    permanent: bool = False
+    expires_at: Optional[float] = None
+
+    @classmethod
+    def from_link(cls, link) -> "CachedLink":
+        expires_at = calendar.timegm(link.expires_at.utctimetuple()) if link.expires_at else None
+        return cls(link.original_url, link.redirect_type == REDIRECT_PERMANENT, expires_at)
+
+    def encode(self) -> str:
+        entry = {"u": self.original_url, "s": time.time() + CACHE_SOFT_EXPIRE}
+        if self.permanent:
+            entry["p"] = 1
+        if self.expires_at:
+            entry["e"] = self.expires_at
+        return json.dumps(entry)
+
+
+def _url_key(short_code: str) -> str:
+    return f"short_url:{short_code}"
+
+
+def get_local_link(short_code: str) -> Optional[CachedLink]:
+    entry = _local.get(short_code)
+    if entry is None:
+        return None
+    if time.monotonic() >= entry[1]:
+        _local.pop(short_code, None)
+        return None
+    _local.move_to_end(short_code)
+    return entry[0]
+
+
+def set_local_link(short_code: str, link: CachedLink):
+    _local[short_code] = (link, time.monotonic() + LOCAL_CACHE_EXPIRE)
+    _local.move_to_end(short_code)
+    while len(_local) > LOCAL_CACHE_SIZE:
+        _local.popitem(last=False)
+
+
+async def get_cached_link(short_code: str) -> Optional[CachedLink]:
+    """Возвращает ссылку из кеша.
+
+    Сначала проверяется локальный кеш воркера, затем Redis.
+    Устаревшая (старше CACHE_SOFT_EXPIRE) запись всё равно отдаётся сразу,
+    а её обновление из Postgres запускается в фоне. Если Redis недоступен,
+    возвращает None, и ссылка ищется в БД.
+    """
+    local_link = get_local_link(short_code)
+    if local_link is not None:
+        return local_link
+
+    try:
+        raw = await redis.get(_url_key(short_code))
+    except RedisUnavailable:
+        return None
+    if raw is None:
+        return None
+
+    try:
+        entry = json.loads(raw)
+    except ValueError:
+        # Запись старого формата: просто URL без мягкого TTL
+        schedule_refresh(short_code)
+        return CachedLink(raw)
+
+    if time.time() >= entry["s"]:
+        schedule_refresh(short_code)
+    link = CachedLink(entry["u"], bool(entry.get("p")), entry.get("e"))
+    set_local_link(short_code, link)
+    return link
+
+
+async def set_cached_link(short_code: str, link: CachedLink):
+    set_local_link(short_code, link)
+    try:
+        await redis.set(_url_key(short_code), link.encode(), ex=CACHE_EXPIRE)
+    except RedisUnavailable:
+        pass
+
+
+async def update_cached_link(short_code: str, link: CachedLink):
+    """Перезаписывает кеш после изменения ссылки и сбрасывает его у остальных воркеров."""
+    set_local_link(short_code, link)
+    try:
+        await redis.set(_url_key(short_code), link.encode(), ex=CACHE_EXPIRE)
+        await redis.publish(INVALIDATE_CHANNEL, short_code)
+    except RedisUnavailable:
+        _pending_invalidations.add(short_code)
+
+
+async def invalidate_cached_link(short_code: str):
+    """Удаляет ссылку из кеша Redis и из локальных кешей всех воркеров."""
+    _local.pop(short_code, None)
+    _pending_counts.pop(short_code, None)
+    try:
+        await redis.delete(_url_key(short_code), f"short_url_count:{short_code}")
+        await redis.publish(INVALIDATE_CHANNEL, short_code)
+    except RedisUnavailable:
+        _pending_invalidations.add(short_code)
+
+
+async def invalidate_cached_links(short_codes, drop_counters: bool = True):
+    """Сбрасывает кеш многих ссылок одним конвейером и одним сообщением в канал."""
+    short_codes = list(short_codes)
+    if not short_codes:
+        return
+    pipe = redis.pipeline(transaction=False)
+    for short_code in short_codes:
+        _local.pop(short_code, None)
+        pipe.delete(_url_key(short_code))
+        if drop_counters:
+            _pending_counts.pop(short_code, None)
+            pipe.delete(f"short_url_count:{short_code}")
+    pipe.publish(INVALIDATE_CHANNEL, "\n".join(short_codes))
+    try:
+        await pipe.execute()
+    except RedisUnavailable:
+        _pending_invalidations.update(short_codes)
+
+
+async def _flush_pending():
+    """Отправляет в Redis то, что накопилось, пока предохранитель был разомкнут."""
+    counts = dict(_pending_counts)
+    invalidations = set(_pending_invalidations)
+    _pending_counts.clear()
+    _pending_invalidations.clear()
+    if not counts and not invalidations:
+        return
+
+    pipe = redis.pipeline(transaction=False)
+    for short_code, count in counts.items():
+        pipe.incrby(f"short_url_count:{short_code}", count)
+    for short_code in invalidations:
+        # Запись удаляется: при следующем обращении она загрузится из БД заново
+        pipe.delete(_url_key(short_code))
+        pipe.publish(INVALIDATE_CHANNEL, short_code)
+    # Команды на доступных узлах уже применились: повторяем только упавшие,
+    # иначе INCRBY учёл бы переходы дважды
+    results = await pipe.execute(raise_on_error=False)
+    for short_code, result in zip(counts, results):
+        if isinstance(result, RedisUnavailable):
+            _pending_counts[short_code] += counts[short_code]
+    results = results[len(counts):]
+    for n, short_code in enumerate(invalidations):
+        if any(isinstance(result, RedisUnavailable) for result in results[2 * n:2 * n + 2]):
+            _pending_invalidations.add(short_code)
+
+
+async def listen_invalidations():
+    """Фоновая задача воркера: сбрасывает локальный кеш по сообщениям из Redis."""
+    while True:
+        pubsub = pubsub_redis.pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATE_CHANNEL)
+            # Пока подписки не было, сообщения могли потеряться
+            _local.clear()
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    # В одном сообщении может быть несколько кодов через перевод строки
+                    for short_code in message["data"].split("\n"):
+                        _local.pop(short_code, None)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+
+def schedule_refresh(short_code: str):
+    """Запускает фоновое обновление записи, не более одного на код в воркере."""
+    if short_code in _refreshing:
+        return
+    _refreshing.add(short_code)
+    task = asyncio.create_task(_refresh_cached_link(short_code))
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+async def _refresh_cached_link(short_code: str):
+    try:
+        # Блокировка в Redis, чтобы в БД шёл один запрос на все воркеры
+        locked = await redis.set(f"short_url_refresh:{short_code}", 1, nx=True, ex=CACHE_REFRESH_LOCK)
+        if not locked:
+            return
+
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(Link.original_url, Link.redirect_type, Link.expires_at).filter_by(short_code=short_code)
+            )
+            link = result.one_or_none()
+
+        if link is None:
+            await redis.delete(_url_key(short_code))
+        else:
+            await set_cached_link(short_code, CachedLink.from_link(link))
+    except RedisUnavailable:
+        pass
+    finally:
+        _refreshing.discard(short_code)
+
+
+async def increase_link_counter(short_code: str):
+    """Увеличивает счётчик обращений; без Redis копит его в памяти воркера."""
+    try:
+        return await redis.incr(f"short_url_count:{short_code}")
+    except RedisUnavailable:
+        _pending_counts[short_code] += 1
+        return _pending_counts[short_code]
+
+
+def cache_stats():
+    return {
+        "breakers": redis.breakers(),
+        "local_cache_size": len(_local),
+        "pending_counters": len(_pending_counts),
+        "pending_invalidations": len(_pending_invalidations),
+    }
@@ -0,0 +1,130 @@
+"""Запись обезличенного журнала запросов для нагрузочного тестирования.
+
+Включается переменной CAPTURE_PATH. Каждая строка — один запрос, поля через
+табуляцию:
+    ts_ms  method  route  short_code  status  duration_us
+
+route — шаблон маршрута ("/links/{short_code}"), "-" для неизвестных путей.
+Запросы, отклонённые до маршрутизатора (admission.py), тоже получают шаблон:
+он подбирается по пути, чтобы при воспроизведении нагрузка была той же.
+Параметры запроса, тела, заголовки и адреса клиентов не записываются.
+Строки копятся в ограниченной очереди и пишутся фоновым потоком пачками с
+O_APPEND, поэтому несколько воркеров могут писать в один файл. При
+переполнении очереди строки отбрасываются, запрос не ждёт.
+
+Воспроизведение: python replay.py <файл> --rate 10
+"""
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+from starlette.routing import Match
+
+from config import CAPTURE_PATH, CAPTURE_QUEUE_SIZE
+
+_queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=CAPTURE_QUEUE_SIZE)
+_writer: Optional[threading.Thread] = None
+_counters = {"written": 0, "dropped": 0}
+
+# Табуляция и перевод строки в коде ссылки сломали бы формат строки
+_FIELD = str.maketrans("\t\n\r", "   ")
+
+
+def _write_lines(fd: int):
+    while True:
+        line = _queue.get()
+        lines = [line]
+        while len(lines) < 1000:
+            try:
+                lines.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = None in lines
+        lines = [line for line in lines if line is not None]
+        if lines:
+            os.write(fd, "".join(lines).encode())
+            _counters["written"] += len(lines)
+        if stop:
+            return
+
+
+def _run(path: str):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        _write_lines(fd)
+    finally:
+        os.close(fd)
+
+
+def start_capture():
+    global _writer
+    if not CAPTURE_PATH or _writer is not None:
+        return
+    _writer = threading.Thread(target=_run, args=(CAPTURE_PATH,), name="capture-writer", daemon=True)
+    _writer.start()
+
+
+def stop_capture():
+    """Дописывает накопленные строки и останавливает поток записи."""
+    global _writer
+    if _writer is None:
+        return
+    _queue.put(None)
+    _writer.join(timeout=5)
+    _writer = None
+
+
+def capture_stats():
+    return {"enabled": bool(CAPTURE_PATH), "depth": _queue.qsize(), **_counters}
+
+
+def route_of(scope) -> tuple:
+    """Шаблон маршрута и параметры пути; "-", если путь не подходит ни к одному маршруту."""
+    route = scope.get("route")
+    if route is not None:
+        # Маршрутизатор дописывает route и path_params в тот же scope
+        return route.path, scope.get("path_params", {})
+    # До маршрутизатора запрос не дошёл: ищем маршрут так же, как он
+    router = getattr(scope.get("app"), "router", None)
+    for candidate in getattr(router, "routes", ()):
+        match, child_scope = candidate.matches(scope)
+        if match == Match.FULL:
+            return candidate.path, child_scope.get("path_params", {})
+    return "-", {}
+
+
+class CaptureMiddleware:
+    """Записывает маршрут, короткий код, статус и время обработки каждого запроса."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route, path_params = route_of(scope)
+            short_code = path_params.get("short_code", "-").translate(_FIELD)
+            line = (
+                f"{int(time.time() * 1000)}\t{scope['method']}\t{route}\t"
+                f"{short_code}\t{status}\t{int((time.perf_counter() - started) * 1_000_000)}\n"
+            )
+            try:
+                _queue.put_nowait(line)
+            except queue.Full:
+                _counters["dropped"] += 1
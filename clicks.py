@@ -0,0 +1,269 @@
+import asyncio
+import hashlib
+import ipaddress
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from fastapi import Request
+from sqlalchemy import text
+
+from auth.database import async_session_maker
+from cache import redis, RedisUnavailable
+from config import (
+    CLICK_QUEUE_SIZE,
+    CLICK_BATCH_SIZE,
+    CLICK_FLUSH_INTERVAL,
+    CLICK_WORKERS,
+    CLICK_STREAM,
+    CLICK_STREAM_MAXLEN,
+    UNIQUE_DAYS,
+    COUNTRY_HEADER,
+)
+from topk import DIMENSIONS, add_counts, referrer_host, country_code, topk_keys
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ClickEvent:
+    short_code: str
+    referrer: Optional[str]
+    user_agent: Optional[str]
+    ip_prefix: Optional[str]
+    visitor: str
+    country: str
+    ts: float
+
+
+_queue: Optional[asyncio.Queue] = None
+_workers: list = []
+_counters = {"enqueued": 0, "dropped": 0, "flushed": 0, "stream_failed": 0, "db_failed": 0, "worker_errors": 0}
+
+# Метка остановки в очереди: обработчик дописывает свою пачку и завершается
+_STOP = None
+
+# Счётчики переходов и время последнего перехода пишутся в link одним запросом на пачку,
+# в том же запросе переходы прибавляются к счётчикам владельцев (owner_usage)
+# Строки link блокируются в порядке short_code: параллельные сбросы с
+# пересекающимися кодами ждут друг друга, а не ловят взаимную блокировку
+UPDATE_VISITS = text(
+    "WITH locked AS ("
+    "SELECT id FROM link WHERE short_code = ANY(CAST(:codes AS text[])) ORDER BY short_code FOR UPDATE"
+    "), updated AS ("
+    "UPDATE link SET visits = coalesce(link.visits, 0) + v.n, "
+    "last_visited = greatest(link.last_visited, v.ts) "
+    "FROM locked, unnest(CAST(:codes AS text[]), CAST(:counts AS integer[]), CAST(:times AS timestamp[])) "
+    "AS v(short_code, n, ts) "
+    "WHERE link.id = locked.id AND link.short_code = v.short_code "
+    "RETURNING link.owner_id, v.n"
+    ") "
+    "INSERT INTO owner_usage (owner_id, links, clicks) "
+    "SELECT owner_id, 0, sum(n) FROM updated WHERE owner_id IS NOT NULL GROUP BY owner_id ORDER BY owner_id "
+    "ON CONFLICT (owner_id) DO UPDATE SET clicks = owner_usage.clicks + excluded.clicks"
+)
+
+
+def ip_prefix(host: Optional[str]) -> Optional[str]:
+    """Обрезает адрес клиента до /24 (IPv4) или /48 (IPv6)."""
+    if not host:
+        return None
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    prefix = 24 if address.version == 4 else 48
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+def visitor_id(host: Optional[str], user_agent: Optional[str]) -> str:
+    """Хеш адреса и User-Agent клиента; сам адрес в HyperLogLog не попадает."""
+    return hashlib.blake2b(f"{host}|{user_agent}".encode(), digest_size=8).hexdigest()
+
+
+def unique_key(short_code: str, day: Optional[date] = None) -> str:
+    """Ключ HyperLogLog посетителей: за день или за всё время (day=None).
+
+    Код ссылки — {тег}, поэтому все окна одной ссылки лежат на одном узле
+    и PFCOUNT может слить их одной командой.
+    """
+    return f"uv:{{{short_code}}}:{day:%Y%m%d}" if day else f"uv:{{{short_code}}}:all"
+
+
+def record_click(request: Request, short_code: str):
+    """Ставит переход в очередь; при переполнении событие отбрасывается."""
+    if _queue is None:
+        return
+    host = request.client.host if request.client else None
+    user_agent = request.headers.get("user-agent")
+    event = ClickEvent(
+        short_code=short_code,
+        referrer=request.headers.get("referer"),
+        user_agent=user_agent,
+        ip_prefix=ip_prefix(host),
+        visitor=visitor_id(host, user_agent),
+        country=country_code(request.headers.get(COUNTRY_HEADER)),
+        ts=time.time(),
+    )
+    try:
+        _queue.put_nowait(event)
+    except asyncio.QueueFull:
+        _counters["dropped"] += 1
+        return
+    _counters["enqueued"] += 1
+
+
+async def _next_batch(queue: asyncio.Queue):
+    """Пачка событий и признак остановки (из очереди взята метка _STOP)."""
+    batch = []
+    event = await queue.get()
+    deadline = time.monotonic() + CLICK_FLUSH_INTERVAL
+    while event is not _STOP:
+        batch.append(event)
+        timeout = deadline - time.monotonic()
+        if len(batch) >= CLICK_BATCH_SIZE or timeout <= 0:
+            return batch, False
+        try:
+            event = await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return batch, False
+    return batch, True
+
+
+async def _write_stream(batch):
+    pipe = redis.pipeline(transaction=False)
+    # Посетители группируются по окну: один PFADD на ссылку и день за всю пачку
+    visitors = defaultdict(set)
+    # Рефереры и страны тоже суммируются по пачке: один вызов Space-Saving на ссылку и срез
+    top = defaultdict(lambda: defaultdict(int))
+    for event in batch:
+        visitors[event.short_code, datetime.utcfromtimestamp(event.ts).date()].add(event.visitor)
+        top[event.short_code, "ref"][referrer_host(event.referrer)] += 1
+        top[event.short_code, "country"][event.country] += 1
+        fields = {"code": event.short_code, "ts": event.ts, "cc": event.country}
+        if event.referrer:
+            fields["ref"] = event.referrer
+        if event.user_agent:
+            fields["ua"] = event.user_agent
+        if event.ip_prefix:
+            fields["ip"] = event.ip_prefix
+        pipe.xadd(CLICK_STREAM, fields, maxlen=CLICK_STREAM_MAXLEN, approximate=True)
+    for (code, day), ids in visitors.items():
+        day_key = unique_key(code, day)
+        pipe.pfadd(day_key, *ids)
+        pipe.expire(day_key, UNIQUE_DAYS * 24 * 3600)
+        pipe.pfadd(unique_key(code), *ids)
+    add_counts(pipe, top)
+    await pipe.execute()
+
+
+async def count_uniques(short_code: str, start: Optional[date] = None, end: Optional[date] = None) -> int:
+    """Оценка числа уникальных посетителей за дни [start, end] или за всё время.
+
+    Дневные окна сливаются на стороне Redis (PFCOUNT по нескольким ключам),
+    стандартная ошибка HyperLogLog — около 0.81%.
+    """
+    if start is None:
+        return await redis.pfcount(unique_key(short_code))
+    days = (end - start).days + 1
+    return await redis.pfcount(*(unique_key(short_code, start + timedelta(days=i)) for i in range(days)))
+
+
+def link_stat_keys(short_code: str) -> list:
+    """Ключи статистики ссылки в Redis: посетители за всё время и за неистёкшие дни, топы рефереров и стран."""
+    today = datetime.utcnow().date()
+    keys = [unique_key(short_code)] + [unique_key(short_code, today - timedelta(days=i)) for i in range(UNIQUE_DAYS + 1)]
+    for dim in DIMENSIONS:
+        keys.extend(topk_keys(short_code, dim))
+    return keys
+
+
+async def drop_link_stats(short_codes):
+    """Удаляет статистику удалённых ссылок, иначе она осталась бы в Redis навсегда."""
+    pipe = redis.pipeline(transaction=False)
+    for short_code in short_codes:
+        # У ключей одной ссылки общий {тег}: один DEL на узел
+        pipe.delete(*link_stat_keys(short_code))
+    try:
+        await pipe.execute()
+    except RedisUnavailable:
+        # Дневные окна истекут сами, остаётся только общий счётчик
+        pass
+
+
+async def _write_visits(batch):
+    counts = defaultdict(int)
+    last = {}
+    for event in batch:
+        counts[event.short_code] += 1
+        last[event.short_code] = max(last.get(event.short_code, 0), event.ts)
+    codes = sorted(counts)
+    async with async_session_maker() as session:
+        await session.execute(UPDATE_VISITS, {
+            "codes": codes,
+            "counts": [counts[code] for code in codes],
+            "times": [datetime.utcfromtimestamp(last[code]) for code in codes],
+        })
+        await session.commit()
+
+
+async def flush_clicks(batch):
+    """Пишет пачку событий в поток Redis и обновляет счётчики в Postgres."""
+    try:
+        await _write_stream(batch)
+    except RedisUnavailable:
+        # Сырые события теряются, счётчики в Postgres всё равно обновятся
+        _counters["stream_failed"] += len(batch)
+    try:
+        await _write_visits(batch)
+    except Exception:
+        logger.exception("click counters not written", extra={"events": len(batch)})
+        _counters["db_failed"] += len(batch)
+        return
+    _counters["flushed"] += len(batch)
+
+
+async def _worker(queue: asyncio.Queue):
+    stop = False
+    while not stop:
+        batch, stop = await _next_batch(queue)
+        if not batch:
+            continue
+        try:
+            await flush_clicks(batch)
+        except Exception:
+            # Обработчик не должен умирать из-за одной пачки: иначе очередь
+            # переполнится и все следующие переходы будут отброшены
+            logger.exception("click batch failed", extra={"events": len(batch)})
+            _counters["worker_errors"] += 1
+
+
+def start_click_workers():
+    global _queue
+    _queue = asyncio.Queue(maxsize=CLICK_QUEUE_SIZE)
+    _workers.extend(asyncio.create_task(_worker(_queue)) for _ in range(CLICK_WORKERS))
+
+
+async def stop_click_workers():
+    """Останавливает обработчики и дописывает то, что осталось в очереди."""
+    global _queue
+    queue, _queue = _queue, None
+    if queue is None:
+        return
+    # Новые переходы в очередь больше не попадают; метки встают после всех
+    # событий, и каждый обработчик дописывает взятую пачку, прежде чем выйти
+    for _ in _workers:
+        await queue.put(_STOP)
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+def click_stats():
+    return {
+        "depth": _queue.qsize() if _queue is not None else 0,
+        "capacity": CLICK_QUEUE_SIZE,
+        **_counters,
+    }
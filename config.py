@@ -10,4 +10,98 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("DB_NAME")
 
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
\ No newline at end of file
+DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost")
+# Узлы для шардирования кеша через запятую; по умолчанию один REDIS_URL
+REDIS_NODES = os.getenv("REDIS_NODES", REDIS_URL).split(",")
+REDIS_VNODES = int(os.getenv("REDIS_VNODES", 160))
+# Таймаут команд Redis (сек) и предохранитель: число ошибок подряд и пауза до пробного запроса
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", 0.1))
+REDIS_BREAKER_FAILURES = int(os.getenv("REDIS_BREAKER_FAILURES", 5))
+REDIS_BREAKER_RESET = float(os.getenv("REDIS_BREAKER_RESET", 5))
+
+# Кеш редиректов: после CACHE_SOFT_EXPIRE секунд запись считается устаревшей
+# и обновляется в фоне, после CACHE_EXPIRE секунд Redis удаляет её совсем
+CACHE_SOFT_EXPIRE = int(os.getenv("CACHE_SOFT_EXPIRE", 3600))
+CACHE_EXPIRE = int(os.getenv("CACHE_EXPIRE", 6 * 3600))
+CACHE_REFRESH_LOCK = int(os.getenv("CACHE_REFRESH_LOCK", 10))
+
+# Локальный кеш воркера поверх Redis, сбрасывается через pub/sub при изменениях
+LOCAL_CACHE_SIZE = int(os.getenv("LOCAL_CACHE_SIZE", 10000))
+LOCAL_CACHE_EXPIRE = int(os.getenv("LOCAL_CACHE_EXPIRE", 30))
+
+# Ограничение частоты запросов: "N/S" — N запросов за S секунд на IP и на пользователя
+RATE_LIMIT_SHORTEN = os.getenv("RATE_LIMIT_SHORTEN", "30/60")
+RATE_LIMIT_AUTH = os.getenv("RATE_LIMIT_AUTH", "10/60")
+# Сколько токенов воркер может взять впрок у клиента, далёкого от лимита
+RATE_LIMIT_LEASE = int(os.getenv("RATE_LIMIT_LEASE", 5))
+RATE_LIMIT_LEASE_TTL = float(os.getenv("RATE_LIMIT_LEASE_TTL", 1))
+
+# Контроль допуска: число одновременных запросов и дедлайн ожидания (сек) по классам маршрутов
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "redirect=256,write=32,auth=16,read=64")
+ADMISSION_DEADLINES = os.getenv("ADMISSION_DEADLINES", "redirect=0.5,write=0.2,auth=1,read=0.5")
+
+# Режим редиректов: "db" — кеш и Postgres, "snapshot" — только файл снимка (см. snapshot.py)
+REDIRECT_MODE = os.getenv("REDIRECT_MODE", "db")
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "links.snap")
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv("SNAPSHOT_CHECK_INTERVAL", 1))
+
+# Очередь событий переходов: размер, пачка, период сброса (сек), число обработчиков
+CLICK_QUEUE_SIZE = int(os.getenv("CLICK_QUEUE_SIZE", 10000))
+CLICK_BATCH_SIZE = int(os.getenv("CLICK_BATCH_SIZE", 500))
+CLICK_FLUSH_INTERVAL = float(os.getenv("CLICK_FLUSH_INTERVAL", 1))
+CLICK_WORKERS = int(os.getenv("CLICK_WORKERS", 1))
+CLICK_STREAM = os.getenv("CLICK_STREAM", "clicks")
+CLICK_STREAM_MAXLEN = int(os.getenv("CLICK_STREAM_MAXLEN", 1000000))
+
+# Максимальный max-age (сек) для постоянных редиректов
+REDIRECT_MAX_AGE = int(os.getenv("REDIRECT_MAX_AGE", 30 * 24 * 3600))
+
+# Максимум коротких кодов в POST /links/stats/batch
+STATS_BATCH_LIMIT = int(os.getenv("STATS_BATCH_LIMIT", 500))
+
+# Архив холодных ссылок: через сколько дней без переходов, период запуска (сек), размер пачки
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 30))
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", 3600))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", 1000))
+
+# Уникальные посетители (HyperLogLog): сколько дней хранить дневные окна
+UNIQUE_DAYS = int(os.getenv("UNIQUE_DAYS", 90))
+
+# Топ рефереров и стран: счётчиков на ссылку в каждом срезе и заголовок CDN со страной
+TOPK_SIZE = int(os.getenv("TOPK_SIZE", 50))
+COUNTRY_HEADER = os.getenv("COUNTRY_HEADER", "cf-ipcountry")
+
+# Профилирование воркера: максимальное окно (сек), период снятия стеков (сек), срок токена X-Profile (сек)
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 60))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+PROFILE_TOKEN_TTL = int(os.getenv("PROFILE_TOKEN_TTL", 300))
+
+# Массовые удаление и перепривязка: ссылок в одной транзакции
+BULK_CHUNK = int(os.getenv("BULK_CHUNK", 1000))
+
+# Поиск по original_url: максимум ссылок на страницу и лимит времени запроса (мс)
+SEARCH_PAGE_LIMIT = int(os.getenv("SEARCH_PAGE_LIMIT", 100))
+SEARCH_TIMEOUT_MS = int(os.getenv("SEARCH_TIMEOUT_MS", 2000))
+
+# Журнал запросов для replay.py: файл (пусто — запись выключена) и размер очереди записи
+CAPTURE_PATH = os.getenv("CAPTURE_PATH", "")
+CAPTURE_QUEUE_SIZE = int(os.getenv("CAPTURE_QUEUE_SIZE", 100000))
+
+# Логи: уровень, размер очереди записи и доля журнала доступа по классам маршрутов
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "redirect=0.01")
+# Писать SQL-запросы в лог (через общую очередь, не напрямую в stdout)
+SQL_ECHO = os.getenv("SQL_ECHO", "").lower() in ("1", "true", "yes")
+
+# Idempotency-Key: сколько хранить ответ (сек), срок отметки "выполняется" (сек), ожидание дубликата (сек)
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 24 * 3600))
+IDEMPOTENCY_PENDING_TTL = int(os.getenv("IDEMPOTENCY_PENDING_TTL", 30))
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", 5))
+
+# Сверка счётчиков владельцев (owner_usage) с таблицами ссылок: период (сек)
+USAGE_RECONCILE_INTERVAL = int(os.getenv("USAGE_RECONCILE_INTERVAL", 3600))
+# Владельцев в одной транзакции сверки
+USAGE_RECONCILE_BATCH = int(os.getenv("USAGE_RECONCILE_BATCH", 500))
@@ -1,10 +1,25 @@
+import asyncio
+import json
+import time
+from datetime import date
+
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from app import app, get_async_session, redis
+from admission import AdmissionControlMiddleware, Gate, gates, route_class
+from archive import COLUMNS
 from models.models import Base, Link, User
 from auth.security import create_access_token
 from auth.database import DATABASE_URL
+from sharding import HashRing
+from clicks import ClickEvent, flush_clicks, unique_key
+from topk import referrer_host, topk_keys
+from replay import Record, build_request
+from capture import route_of
+from snapshot import Snapshot, write_snapshot
+from usage import reconcile_usage
 pytestmark = pytest.mark.asyncio
 
 engine = create_async_engine(DATABASE_URL, echo=True)
@@ -51,6 +66,31 @@ def test_token(test_user):
     return create_access_token(data={"sub": test_user.username})
 
 
+# Тестовый пользователь в базе: нужен там, где ссылки принадлежат владельцу
+@pytest.fixture(scope="function")
+async def db_user(test_db, test_user):
+    async with TestingSessionLocal() as session:
+        session.add(User(
+            id=test_user.id,
+            username=test_user.username,
+            email=test_user.email,
+            hashed_password=test_user.hashed_password,
+            is_active=True
+        ))
+        await session.commit()
+    return test_user
+
+
+# Переносит ссылку в link_archive так же, как архиватор (archive.py)
+async def archive_link(short_code: str):
+    async with TestingSessionLocal() as session:
+        await session.execute(text(
+            f"WITH moved AS (DELETE FROM link WHERE short_code = :short_code RETURNING {COLUMNS}) "
+            f"INSERT INTO link_archive ({COLUMNS}, archived_at) SELECT {COLUMNS}, now() FROM moved"
+        ), {"short_code": short_code})
+        await session.commit()
+
+
 # Тесты для эндпоинтов
 class TestShortenLink:
     async def test_create_short_link_unauthorized(self, test_client, test_db):
@@ -74,6 +114,17 @@ class TestShortenLink:
 
         assert response.status_code == 200
 
+    async def test_idempotent_retry(self, test_client, test_db):
+        headers = {"Idempotency-Key": "retry-1"}
+        params = {"original_url": "https://idempotent.com"}
+        first = test_client.post("/links/shorten", params=params, headers=headers)
+        second = test_client.post("/links/shorten", params=params, headers=headers)
+        assert first.status_code == 200
+        assert second.json()["short_code"] == first.json()["short_code"]
+
+        response = test_client.post("/links/shorten", params={"original_url": "https://other.com"}, headers=headers)
+        assert response.status_code == 422
+
     async def test_create_duplicate_alias(self, test_client, test_db):
         response = test_client.post(
             "/links/shorten",
@@ -94,6 +145,14 @@ class TestShortenLink:
         assert response.status_code == 400
         assert "Alias уже существует" in response.json()["detail"]
 
+    async def test_create_populates_cache(self, test_client, test_db):
+        response = test_client.post(
+            "/links/shorten",
+            params={"original_url": "https://cached.com", "custom_alias": "cached"}
+        )
+        assert response.status_code == 200
+        assert json.loads(await redis.get("short_url:cached"))["u"] == "https://cached.com"
+
 
 class TestRedirect:
     async def test_redirect_nonexistent_link(self, test_client):
@@ -101,6 +160,22 @@ class TestRedirect:
         assert response.status_code == 404
         assert "Ссылка не найдена" in response.json()["detail"]
 
+    async def test_redirect_permanent(self, test_client, test_db):
+        test_client.post(
+            "/links/shorten",
+            params={"original_url": "https://permanent.com", "custom_alias": "permanent", "permanent": True}
+        )
+        response = test_client.get("/links/permanent", follow_redirects=False)
+        assert response.status_code == 308
+        assert response.headers["cache-control"].startswith("public, max-age=")
+
+    async def test_redirect_serves_stale_cache(self, test_client, test_db):
+        # Устаревшая запись отдаётся сразу, обновление идёт в фоне
+        await redis.set("short_url:stale-link", json.dumps({"u": "https://stale.com", "s": 0}))
+        response = test_client.get("/links/stale-link", follow_redirects=False)
+        assert response.status_code == 307
+        assert response.headers["location"] == "https://stale.com"
+
 
 class TestDeleteLink:
     async def test_delete_link_unauthorized(self, test_client, test_db):
@@ -130,6 +205,62 @@ class TestDeleteLink:
         assert response.status_code == 200
         assert response.json()["message"] == "Ссылка успешно удалена"
 
+    async def test_delete_archived_link(self, test_client, test_db, test_token):
+        headers = {"Authorization": f"Bearer {test_token}"}
+        test_client.post(
+            "/links/shorten",
+            params={"original_url": "https://archived-delete.com", "custom_alias": "archived-delete"},
+            headers=headers
+        )
+        await archive_link("archived-delete")
+
+        assert test_client.get("/links/archived-delete/stats").status_code == 200
+        response = test_client.delete("/links/archived-delete", headers=headers)
+        assert response.status_code == 200
+        assert test_client.get("/links/archived-delete/stats").status_code == 404
+
+    async def test_delete_drops_link_stats(self, test_client, test_db, test_token):
+        headers = {"Authorization": f"Bearer {test_token}"}
+        test_client.post(
+            "/links/shorten",
+            params={"original_url": "https://uv-delete.com", "custom_alias": "uv-delete"},
+            headers=headers
+        )
+        pipe = redis.pipeline()
+        pipe.pfadd(unique_key("uv-delete"), "visitor")
+        pipe.pfadd(unique_key("uv-delete", date.today()), "visitor")
+        pipe.zadd(topk_keys("uv-delete", "ref")[0], {"example.com": 1})
+        await pipe.execute()
+
+        assert test_client.delete("/links/uv-delete", headers=headers).status_code == 200
+        assert await redis.pfcount(unique_key("uv-delete")) == 0
+        assert await redis.pfcount(unique_key("uv-delete", date.today())) == 0
+        assert await redis.zcount(topk_keys("uv-delete", "ref")[0], "-inf", "+inf") == 0
+
+    async def test_bulk_delete_only_own_links(self, test_client, test_db, test_token):
+        headers = {"Authorization": f"Bearer {test_token}"}
+        for alias in ("bulk-1", "bulk-2"):
+            test_client.post(
+                "/links/shorten",
+                params={"original_url": f"https://{alias}.com", "custom_alias": alias},
+                headers=headers
+            )
+        test_client.post("/links/shorten", params={"original_url": "https://bulk-3.com", "custom_alias": "bulk-3"})
+
+        response = test_client.post(
+            "/links/bulk/delete",
+            json={"short_codes": ["bulk-1", "bulk-2", "bulk-3"]},
+            headers=headers
+        )
+        assert response.status_code == 200
+        assert response.json()["deleted"] == 2
+        assert test_client.get("/links/bulk-3/stats").status_code == 200
+
+    async def test_bulk_delete_requires_filter(self, test_client, test_db, test_token):
+        headers = {"Authorization": f"Bearer {test_token}"}
+        response = test_client.post("/links/bulk/delete", json={}, headers=headers)
+        assert response.status_code == 400
+
 
 class TestStatistics:
     async def test_get_stats(self, test_client, test_db):
@@ -142,6 +273,91 @@ class TestStatistics:
         assert response.status_code == 200
         assert response.json()["original_url"] == "https://stats-test.com"
 
+    async def test_get_stats_batch(self, test_client, test_db):
+        test_client.post(
+            "/links/shorten",
+            params={"original_url": "https://batch-test.com", "custom_alias": "batch-test"}
+        )
+
+        response = test_client.post("/links/stats/batch", json={"short_codes": ["batch-test", "batch-missing"]})
+        assert response.status_code == 200
+        assert response.json()["links"]["batch-test"]["original_url"] == "https://batch-test.com"
+        assert response.json()["missing"] == ["batch-missing"]
+
+    async def test_get_uniques(self, test_client, test_db):
+        test_client.post(
+            "/links/shorten",
+            params={"original_url": "https://uniques-test.com", "custom_alias": "uniques-test"}
+        )
+
+        response = test_client.get("/links/uniques-test/stats/uniques")
+        assert response.status_code == 200
+        assert response.json()["unique_visitors"] == 0
+
+        response = test_client.get(
+            "/links/uniques-test/stats/uniques",
+            params={"start": "2026-01-02", "end": "2026-01-01"}
+        )
+        assert response.status_code == 400
+
+    async def test_get_top(self, test_client, test_db):
+        test_client.post(
+            "/links/shorten",
+            params={"original_url": "https://top-test.com", "custom_alias": "top-test"}
+        )
+
+        response = test_client.get("/links/top-test/stats/top", params={"limit": 5})
+        assert response.status_code == 200
+        assert response.json()["referrers"] == []
+        assert response.json()["countries"] == []
+
+
+class TestUsage:
+    async def test_usage_requires_auth(self, test_client, test_db):
+        response = test_client.get("/auth/me/usage")
+        assert response.status_code == 401
+
+    async def test_usage_follows_create_and_delete(self, test_client, db_user, test_token):
+        headers = {"Authorization": f"Bearer {test_token}"}
+        for alias in ("usage-1", "usage-2"):
+            test_client.post(
+                "/links/shorten",
+                params={"original_url": f"https://{alias}.com", "custom_alias": alias},
+                headers=headers
+            )
+        assert test_client.get("/auth/me/usage", headers=headers).json()["links"] == 2
+
+        test_client.delete("/links/usage-1", headers=headers)
+        assert test_client.get("/auth/me/usage", headers=headers).json()["links"] == 1
+
+    async def test_usage_counts_flushed_clicks(self, test_client, db_user, test_token):
+        headers = {"Authorization": f"Bearer {test_token}"}
+        test_client.post(
+            "/links/shorten",
+            params={"original_url": "https://usage-clicks.com", "custom_alias": "usage-clicks"},
+            headers=headers
+        )
+        event = ClickEvent("usage-clicks", None, None, None, "visitor", "XX", time.time())
+        await flush_clicks([event] * 3)
+
+        usage = test_client.get("/auth/me/usage", headers=headers).json()
+        assert (usage["links"], usage["clicks"]) == (1, 3)
+
+    async def test_reconcile_fixes_drift(self, test_client, db_user, test_token):
+        headers = {"Authorization": f"Bearer {test_token}"}
+        test_client.post(
+            "/links/shorten",
+            params={"original_url": "https://usage-drift.com", "custom_alias": "usage-drift"},
+            headers=headers
+        )
+        async with TestingSessionLocal() as session:
+            await session.execute(text("UPDATE owner_usage SET links = 10, clicks = 5"))
+            await session.commit()
+
+        assert await reconcile_usage()
+        usage = test_client.get("/auth/me/usage", headers=headers).json()
+        assert (usage["links"], usage["clicks"]) == (1, 0)
+
 
 class TestSearch:
     @pytest.mark.asyncio
@@ -156,6 +372,185 @@ class TestSearch:
         assert response.status_code == 200
         assert response.json()["short_code"] == "search-alias"
 
+    async def test_search_matches_requires_auth(self, test_client, test_db):
+        response = test_client.get("/links/url/matches", params={"q": "search-test.com", "mode": "domain"})
+        assert response.status_code == 401
+
+    async def test_search_matches(self, test_client, db_user, test_token):
+        headers = {"Authorization": f"Bearer {test_token}"}
+        urls = {
+            "m-shop": "https://shop.example.com/campaign/1",
+            "m-root": "http://example.com/campaign/2",
+            "m-lookalike": "https://notexample.com/campaign",
+            "m-query": "https://other.org/?ref=example.com",
+        }
+        for alias, url in urls.items():
+            test_client.post("/links/shorten", params={"original_url": url, "custom_alias": alias}, headers=headers)
+        # Поиск должен находить и архивные ссылки
+        await archive_link("m-shop")
+        await archive_link("m-lookalike")
+
+        def found(q, mode):
+            response = test_client.get("/links/url/matches", params={"q": q, "mode": mode}, headers=headers)
+            assert response.status_code == 200
+            return {link["short_code"] for link in response.json()["links"]}
+
+        assert found("example.com/campaign", "prefix") == {"m-root"}
+        assert found("example.com", "domain") == {"m-shop", "m-root"}
+        assert found("campaign", "substring") == {"m-shop", "m-root", "m-lookalike"}
+
+    async def test_search_matches_pagination(self, test_client, db_user, test_token):
+        headers = {"Authorization": f"Bearer {test_token}"}
+        for n in range(3):
+            test_client.post(
+                "/links/shorten",
+                params={"original_url": f"https://paged.example/{n}", "custom_alias": f"paged-{n}"},
+                headers=headers
+            )
+        await archive_link("paged-0")
+
+        params = {"q": "paged.example", "mode": "domain", "limit": 2}
+        first = test_client.get("/links/url/matches", params=params, headers=headers).json()
+        assert [link["short_code"] for link in first["links"]] == ["paged-0", "paged-1"]
+        assert first["links"][0]["archived"] is True
+        second = test_client.get("/links/url/matches", params={**params, "after": first["next"]}, headers=headers).json()
+        assert [link["short_code"] for link in second["links"]] == ["paged-2"]
+        assert second["next"] is None
+
+
+class TestRateLimit:
+    async def test_token_rate_limited(self, test_client, test_db):
+        statuses = [
+            test_client.post("/auth/token", data={"username": "nobody", "password": "wrong"}).status_code
+            for _ in range(11)
+        ]
+        assert statuses[:10] == [401] * 10
+        assert statuses[-1] == 429
+
+
+class TestMetrics:
+    async def test_metrics(self, test_client):
+        response = test_client.get("/metrics")
+        assert response.status_code == 200
+        assert all(breaker["state"] == "closed" for breaker in response.json()["redis"]["breakers"])
+        assert "redirect" in response.json()["admission"]
+        assert response.json()["clicks"]["dropped"] == 0
+        assert response.json()["logging"]["dropped"] == 0
+
+
+class TestProfiling:
+    async def test_profile_requires_auth(self, test_client):
+        response = test_client.get("/admin/profile", params={"seconds": 0.1})
+        assert response.status_code == 401
+
+    async def test_invalid_profile_token(self, test_client):
+        response = test_client.get("/metrics", headers={"X-Profile": "invalid"})
+        assert response.status_code == 403
+
+
+class TestReplay:
+    async def test_build_request(self):
+        record = Record(0, "PUT", "/links/{short_code}/update-url", "abc")
+        method, url, params, body, headers = build_request(record, 7)
+        assert (method, url) == ("PUT", "/links/abc/update-url")
+        assert params == {"new_url": "https://replay.example/7"}
+        assert build_request(Record(0, "GET", "-", "-"), 0) is None
+
+    async def test_capture_route_without_router(self):
+        # Запрос, отклонённый admission, не доходит до маршрутизатора
+        scope = {"type": "http", "app": app, "method": "GET", "path": "/links/abc", "root_path": ""}
+        assert route_of(scope) == ("/links/{short_code}", {"short_code": "abc"})
+        assert route_of({**scope, "path": "/no/such/path"}) == ("-", {})
+
+
+class TestSnapshot:
+    async def test_lookup(self, tmp_path):
+        path = str(tmp_path / "links.snap")
+        records = [(b"abc", b"https://abc.com", 0), (b"abd", b"https://abd.com", 1)]
+        write_snapshot(path, iter(records), max_id=2)
+
+        snapshot = Snapshot(path)
+        assert snapshot.lookup("abc") == ("https://abc.com", 0)
+        assert snapshot.lookup("abd") == ("https://abd.com", 1)
+        assert snapshot.lookup("abe") is None
+        snapshot.close()
+
+
+class TestAdmission:
+    async def test_route_class(self):
+        assert route_class("GET", "/links/abc") == "redirect"
+        assert route_class("GET", "/links/abc/stats") == "read"
+        assert route_class("POST", "/links/stats/batch") == "read"
+        assert route_class("POST", "/links/shorten") == "write"
+        assert route_class("DELETE", "/links/abc") == "write"
+        assert route_class("POST", "/auth/token") == "auth"
+        assert route_class("GET", "/metrics") == "read"
+
+    async def test_gate_rejects_after_deadline(self):
+        gate = Gate(limit=1, deadline=0.01)
+        assert await gate.acquire()
+        assert not await gate.acquire()
+        assert gate.stats()["rejected"] == 1
+        assert gate.stats()["waiting"] == 0
+
+    async def test_gate_hands_slot_to_waiter(self):
+        gate = Gate(limit=1, deadline=1.0)
+        await gate.acquire()
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        gate.release()
+        # Слот перешёл ожидающему, active не опускался
+        assert await waiter
+        assert gate.active == 1
+        gate.release()
+        assert gate.active == 0
+
+    async def test_writes_shed_while_redirects_wait(self, monkeypatch):
+        redirect, write = Gate(limit=1, deadline=1.0), Gate(limit=1, deadline=1.0)
+        monkeypatch.setitem(gates, "redirect", redirect)
+        monkeypatch.setitem(gates, "write", write)
+        await redirect.acquire()
+        queued_redirect = asyncio.ensure_future(redirect.acquire())
+        await write.acquire()
+        await asyncio.sleep(0)
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        started = time.monotonic()
+        scope = {"type": "http", "method": "POST", "path": "/links/shorten", "headers": []}
+        await AdmissionControlMiddleware(app=None)(scope, None, send)
+        # Запись получает 503 сразу, не дожидаясь дедлайна
+        assert sent[0]["status"] == 503
+        assert time.monotonic() - started < 0.5
+        redirect.release()
+        assert await queued_redirect
+
+
+class TestTopK:
+    async def test_referrer_host(self):
+        assert referrer_host(None) == "direct"
+        assert referrer_host("https://Example.com:8080/page") == "example.com"
+        # Битый Referer не должен ронять обработчик переходов
+        assert referrer_host("http://[") == "unknown"
+
+
+class TestHashRing:
+    async def test_adding_node_moves_few_keys(self):
+        keys = [f"short_url:{i}" for i in range(10000)]
+        before = HashRing(["redis://a", "redis://b", "redis://c"])
+        after = HashRing(["redis://a", "redis://b", "redis://c", "redis://d"])
+        moved = sum(before.node_for(key) != after.node_for(key) for key in keys)
+        assert moved / len(keys) < 0.35
+
+    async def test_hash_tag(self):
+        ring = HashRing(["redis://a", "redis://b", "redis://c"])
+        day = unique_key("abc", date(2026, 1, 1))
+        assert day == "uv:{abc}:20260101"
+        assert ring.node_for(day) == ring.node_for(unique_key("abc"))
+
 
 # Фикстура для очистки Redis
 @pytest.fixture(autouse=True)
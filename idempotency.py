@@ -0,0 +1,110 @@
+"""Идемпотентное создание ссылок по заголовку Idempotency-Key.
+
+Ответ на первый запрос с ключом хранится в Redis IDEMPOTENCY_TTL секунд;
+повтор с тем же ключом и владельцем получает его же, не обращаясь к Postgres.
+Повтор с тем же ключом, но другими параметрами получает 422.
+
+Пока первый запрос выполняется, в Redis лежит отметка "pending" (SET NX).
+Дубликаты в том же воркере ждут общий Future, в других воркерах — опрашивают
+Redis до IDEMPOTENCY_WAIT секунд, затем получают 409. Если первый запрос
+завершился ошибкой, отметка удаляется, и повтор выполнится заново.
+Без Redis запросы выполняются как обычно, без защиты от дублей.
+"""
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+from cache import redis, RedisUnavailable
+from config import IDEMPOTENCY_TTL, IDEMPOTENCY_PENDING_TTL, IDEMPOTENCY_WAIT
+
+PENDING = "pending"
+DONE = "done"
+KEY_REUSED = "Idempotency-Key уже использован с другими параметрами"
+
+_inflight: dict = {}
+
+
+def _fingerprint(params) -> str:
+    return hashlib.sha256(json.dumps(params, default=str).encode()).hexdigest()
+
+
+def _check(entry: dict, fingerprint: str) -> dict:
+    if entry["fp"] != fingerprint:
+        raise HTTPException(status_code=422, detail=KEY_REUSED)
+    return entry["response"]
+
+
+async def _wait_done(key: str, fingerprint: str) -> dict:
+    """Ждёт, пока запрос с тем же ключом в другом воркере допишет ответ."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + IDEMPOTENCY_WAIT
+    while True:
+        try:
+            raw = await redis.get(key)
+        except RedisUnavailable:
+            raw = None
+        if raw is None:
+            # Первый запрос упал и снял отметку (или Redis недоступен): клиент может повторить
+            raise HTTPException(status_code=409, detail="Запрос с этим ключом не завершился, повторите",
+                                headers={"Retry-After": "1"})
+        entry = json.loads(raw)
+        if entry["state"] == DONE or entry["fp"] != fingerprint:
+            return _check(entry, fingerprint)
+        if loop.time() >= deadline:
+            raise HTTPException(status_code=409, detail="Запрос с этим ключом ещё выполняется",
+                                headers={"Retry-After": "1"})
+        await asyncio.sleep(0.05)
+
+
+async def _run(key: str, fingerprint: str, create: Callable[[], Awaitable[dict]]) -> dict:
+    pending = json.dumps({"state": PENDING, "fp": fingerprint})
+    try:
+        acquired = await redis.set(key, pending, nx=True, ex=IDEMPOTENCY_PENDING_TTL)
+    except RedisUnavailable:
+        return await create()
+    if not acquired:
+        return await _wait_done(key, fingerprint)
+
+    try:
+        response = await create()
+    except BaseException:
+        try:
+            await redis.delete(key)
+        except RedisUnavailable:
+            pass
+        raise
+    try:
+        await redis.set(key, json.dumps({"state": DONE, "fp": fingerprint, "response": jsonable_encoder(response)}),
+                        ex=IDEMPOTENCY_TTL)
+    except RedisUnavailable:
+        pass
+    return response
+
+
+async def idempotent(
+    idempotency_key: Optional[str],
+    owner_id: Optional[int],
+    params,
+    create: Callable[[], Awaitable[dict]],
+) -> dict:
+    """Выполняет create() не больше одного раза на (владелец, ключ)."""
+    if not idempotency_key:
+        return await create()
+
+    key = f"idem:{owner_id if owner_id is not None else 'anon'}:{idempotency_key}"
+    fingerprint = _fingerprint(params)
+    if key in _inflight:
+        # Дубликат в том же воркере ждёт результат первого запроса
+        first_fingerprint, future = _inflight[key]
+        if first_fingerprint != fingerprint:
+            raise HTTPException(status_code=422, detail=KEY_REUSED)
+        return await asyncio.shield(future)
+
+    future = asyncio.ensure_future(_run(key, fingerprint, create))
+    _inflight[key] = (fingerprint, future)
+    future.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(future)
@@ -0,0 +1,144 @@
+"""Структурированные логи, которые не блокируют обработку запросов.
+
+Записи уходят в ограниченную очередь, JSON собирается и пишется в stdout
+фоновым потоком (QueueListener). Если очередь заполнена, запись
+отбрасывается и учитывается в счётчике dropped, запрос её не ждёт.
+
+Журнал доступа (AccessLogMiddleware) пишется по классу маршрута
+(admission.route_class) с долей из LOG_SAMPLE, например
+"redirect=0.01,read=1": логируется 1% редиректов. Ответы 5xx пишутся всегда.
+
+Поля события передаются через extra:
+    logger.info("link not found", extra={"original_url": url})
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from admission import route_class
+from config import LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE
+
+# Атрибуты LogRecord, которые не являются полями события
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_listener: Optional[logging.handlers.QueueListener] = None
+_counters = {"dropped": 0, "sampled_out": 0}
+
+access_logger = logging.getLogger("access")
+
+
+def parse_sample(value: str) -> dict:
+    rates = {}
+    for item in value.split(","):
+        if item.strip():
+            name, rate = item.split("=")
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+SAMPLE_RATES = parse_sample(LOG_SAMPLE)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не ждёт места в очереди и не форматирует запись в потоке запроса."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _counters["dropped"] += 1
+
+
+def setup_logging():
+    """Направляет корневой логгер в очередь; вызывается при импорте приложения."""
+    root = logging.getLogger()
+    if any(isinstance(handler, DroppingQueueHandler) for handler in root.handlers):
+        return
+    root.addHandler(DroppingQueueHandler(_queue))
+    root.setLevel(LOG_LEVEL)
+
+
+def start_logging():
+    """Запускает поток записи. Вызывается в воркере: поток мастера не переживает fork."""
+    global _listener
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(_queue, handler, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """Дописывает очередь и останавливает поток записи."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+
+
+def logging_stats():
+    return {"depth": _queue.qsize(), "capacity": LOG_QUEUE_SIZE, **_counters}
+
+
+class AccessLogMiddleware:
+    """Пишет в журнал доступа метод, маршрут, статус и время обработки запроса."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            kind = route_class(scope["method"], scope["path"])
+            if status < 500 and random.random() >= SAMPLE_RATES.get(kind, 1.0):
+                _counters["sampled_out"] += 1
+            else:
+                route = scope.get("route")
+                access_logger.info("request", extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": getattr(route, "path", None),
+                    "class": kind,
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                })
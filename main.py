@@ -1,5 +1,97 @@
-import uvicorn
+"""Точка входа сервиса.
 
-if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", log_level="info")
+    python main.py                    # gunicorn + uvicorn-воркеры
+    python main.py --workers 8        # число воркеров (или WEB_WORKERS)
+    python main.py --no-preload       # импортировать приложение в каждом воркере
+    python main.py --dev              # один процесс uvicorn с автоперезагрузкой
+    python main.py --import-profile   # время импорта модулей приложения
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+def import_profile(limit: int = 20):
+    """Печатает модули, дольше всего импортируемые вместе с app."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        head, cumulative_us, name = line.split("|")
+        rows.append((int(cumulative_us), int(head.split(":")[1]), name.strip()))
+
+    total = max((row[0] for row in rows), default=0)
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:limit]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>8.1f}  {name}")
+    print(f"всего: {total / 1000:.1f} ms")
+
+
+def worker_class():
+    from uvicorn.workers import UvicornWorker
+
+    class FastUvicornWorker(UvicornWorker):
+        # uvloop и httptools, если установлены, иначе стандартные asyncio и h11
+        CONFIG_KWARGS = {"loop": "auto", "http": "auto", "lifespan": "on"}
+
+    return FastUvicornWorker
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
 
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", args.bind)
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("worker_class", worker_class())
+            self.cfg.set("preload_app", args.preload)
+            self.cfg.set("timeout", args.timeout)
+            self.cfg.set("graceful_timeout", args.timeout)
+            self.cfg.set("keepalive", 5)
+
+        def load(self):
+            started = time.perf_counter()
+            from app import app
+
+            print(f"app импортирован за {(time.perf_counter() - started) * 1000:.0f} ms", flush=True)
+            return app
+
+    Server().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск сервиса коротких ссылок")
+    parser.add_argument("--bind", default=os.getenv("WEB_BIND", "0.0.0.0:8000"))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_WORKERS", 4)))
+    parser.add_argument("--timeout", type=int, default=int(os.getenv("WEB_TIMEOUT", 30)))
+    parser.add_argument(
+        "--no-preload",
+        dest="preload",
+        action="store_false",
+        help="по умолчанию приложение импортируется один раз в мастере до fork",
+    )
+    parser.add_argument("--dev", action="store_true", help="uvicorn с автоперезагрузкой")
+    parser.add_argument("--import-profile", action="store_true")
+    args = parser.parse_args()
+
+    if args.import_profile:
+        import_profile()
+    elif args.dev:
+        import uvicorn
+
+        host, _, port = args.bind.rpartition(":")
+        uvicorn.run("app:app", host=host, port=int(port), log_level="info", reload=True)
+    else:
+        run_gunicorn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""added redirect type
+
+Revision ID: 3f9a1c2d7b40
+Revises: fac3238c02e9
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9a1c2d7b40'
+down_revision: Union[str, None] = 'fac3238c02e9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('link', sa.Column('redirect_type', sa.String(), server_default='temporary', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('link', 'redirect_type')
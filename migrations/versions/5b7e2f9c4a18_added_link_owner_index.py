@@ -0,0 +1,30 @@
+"""added link owner index
+
+Revision ID: 5b7e2f9c4a18
+Revises: 8d2e4b6a1c93
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7e2f9c4a18'
+down_revision: Union[str, None] = '8d2e4b6a1c93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_link_owner_id'), 'link', ['owner_id'], unique=False)
+    op.create_index(op.f('ix_link_archive_owner_id'), 'link_archive', ['owner_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_link_archive_owner_id'), table_name='link_archive')
+    op.drop_index(op.f('ix_link_owner_id'), table_name='link')
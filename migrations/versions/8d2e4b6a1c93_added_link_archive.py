@@ -0,0 +1,43 @@
+"""added link archive
+
+Revision ID: 8d2e4b6a1c93
+Revises: 3f9a1c2d7b40
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2e4b6a1c93'
+down_revision: Union[str, None] = '3f9a1c2d7b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('link_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('short_code', sa.String(), nullable=True),
+    sa.Column('original_url', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('visits', sa.Integer(), nullable=True),
+    sa.Column('last_visited', sa.DateTime(), nullable=True),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.Column('owner_id', sa.Integer(), nullable=True),
+    sa.Column('redirect_type', sa.String(), server_default='temporary', nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['owner_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_link_archive_short_code'), 'link_archive', ['short_code'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_link_archive_short_code'), table_name='link_archive')
+    op.drop_table('link_archive')
@@ -0,0 +1,40 @@
+"""added original_url trigram index
+
+Revision ID: c4d81a7e3f25
+Revises: 5b7e2f9c4a18
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d81a7e3f25'
+down_revision: Union[str, None] = '5b7e2f9c4a18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Индексы для поиска по подстроке и регулярным выражениям (GET /links/url/matches),
+    # поиск идёт и по архиву. В модели их нет: create_all в тестах не требует расширения pg_trgm.
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in ('link', 'link_archive'):
+        op.create_index(
+            f'ix_{table}_original_url_trgm',
+            table,
+            ['original_url'],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_ops={'original_url': 'gin_trgm_ops'},
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_link_archive_original_url_trgm', table_name='link_archive')
+    op.drop_index('ix_link_original_url_trgm', table_name='link')
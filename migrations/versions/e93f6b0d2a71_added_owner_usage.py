@@ -0,0 +1,46 @@
+"""added owner usage
+
+Revision ID: e93f6b0d2a71
+Revises: c4d81a7e3f25
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e93f6b0d2a71'
+down_revision: Union[str, None] = 'c4d81a7e3f25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('owner_usage',
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('links', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('clicks', sa.BigInteger(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('owner_id')
+    )
+    # Начальные значения по существующим ссылкам
+    op.execute("""
+        INSERT INTO owner_usage (owner_id, links, clicks)
+        SELECT owner_id, count(*), coalesce(sum(visits), 0)
+        FROM (
+            SELECT owner_id, visits FROM link
+            UNION ALL
+            SELECT owner_id, visits FROM link_archive
+        ) AS all_links
+        WHERE owner_id IS NOT NULL
+        GROUP BY owner_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('owner_usage')
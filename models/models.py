@@ -1,5 +1,4 @@
-from passlib.handlers import bcrypt
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, TIMESTAMP, Boolean
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, ForeignKey, TIMESTAMP, Boolean
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
@@ -21,8 +20,16 @@ class User(Base):
 
 
     def verify_password(self, password):
+        from passlib.handlers import bcrypt
+
         return bcrypt.verify(password, self.password_hash)
 
+# Политика редиректа: временный 307 без кеширования или постоянный 308,
+# который браузеры и CDN могут кешировать
+REDIRECT_TEMPORARY = "temporary"
+REDIRECT_PERMANENT = "permanent"
+
+
 class Link(Base):
     __tablename__ = "link"
     id = Column(Integer, primary_key=True, index=True)
@@ -32,10 +39,31 @@ class Link(Base):
     visits = Column(Integer, default=0)
     last_visited = Column(DateTime, nullable=True)
     expires_at = Column(DateTime, nullable=True)
-    owner_id = Column(Integer, ForeignKey("user.id"), nullable=True)
+    owner_id = Column(Integer, ForeignKey("user.id"), nullable=True, index=True)
+    redirect_type = Column(String, default=REDIRECT_TEMPORARY, server_default=REDIRECT_TEMPORARY, nullable=False)
 
     # Обратная связь с пользователем
     owner = relationship("User", back_populates="links")
 
 
+# Ссылки, по которым давно не переходили (см. archive.py)
+class LinkArchive(Base):
+    __tablename__ = "link_archive"
+    id = Column(Integer, primary_key=True)
+    short_code = Column(String, unique=True, index=True)
+    original_url = Column(String)
+    created_at = Column(DateTime)
+    visits = Column(Integer, default=0)
+    last_visited = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    owner_id = Column(Integer, ForeignKey("user.id"), nullable=True, index=True)
+    redirect_type = Column(String, default=REDIRECT_TEMPORARY, server_default=REDIRECT_TEMPORARY, nullable=False)
+    archived_at = Column(DateTime)
+
 
+# Счётчики владельца, которые обновляются вместе со ссылками (см. usage.py)
+class OwnerUsage(Base):
+    __tablename__ = "owner_usage"
+    owner_id = Column(Integer, ForeignKey("user.id"), primary_key=True)
+    links = Column(Integer, default=0, server_default="0", nullable=False)
+    clicks = Column(BigInteger, default=0, server_default="0", nullable=False)
@@ -0,0 +1,194 @@
+"""Профилирование живого воркера по запросу администратора.
+
+Два режима:
+    * окно — GET /admin/profile?seconds=10 снимает стеки потока event loop
+      в течение окна, пока воркер обслуживает обычный трафик;
+    * один запрос — запрос с заголовком X-Profile: <токен> выполняется под
+      профилировщиком, и вместо ответа возвращается профиль (исходный статус
+      в заголовке X-Profile-Status). Токен выдаёт POST /admin/profile/token.
+
+Формат: collapsed (строки "f1;f2;f3 N" для flamegraph.pl и speedscope) или
+pstats (текстовый отчёт cProfile по cumulative). В одном потоке с запросом
+крутятся и другие задачи event loop, поэтому их кадры тоже попадают в профиль.
+
+Пока профилирование не запрошено, потоков и хуков нет: middleware только
+ищет заголовок X-Profile среди заголовков запроса.
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+import jwt
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from auth.database import User
+from auth.security import SECRET_KEY, ALGORITHM, current_superuser
+from config import PROFILE_MAX_SECONDS, PROFILE_INTERVAL, PROFILE_TOKEN_TTL
+
+FORMATS = ("collapsed", "pstats")
+PROFILE_HEADER = b"x-profile"
+FORMAT_HEADER = b"x-profile-format"
+
+# Одновременно в воркере работает не больше одного профилировщика
+_busy = False
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        stack.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class StackSampler(threading.Thread):
+    """Раз в interval секунд снимает стек заданного потока и считает одинаковые стеки."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def stop(self) -> str:
+        self._stopped.set()
+        self.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Profiler:
+    """Общий интерфейс двух режимов: start() в потоке event loop, stop() -> текст отчёта."""
+
+    def __init__(self, output: str, interval: float = PROFILE_INTERVAL):
+        self.output = output
+        self.interval = interval
+
+    def start(self):
+        global _busy
+        if _busy:
+            raise RuntimeError("профилирование уже идёт")
+        _busy = True
+        if self.output == "collapsed":
+            self.sampler = StackSampler(threading.get_ident(), self.interval)
+            self.sampler.start()
+        else:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop(self) -> str:
+        global _busy
+        try:
+            if self.output == "collapsed":
+                return self.sampler.stop()
+            self.profile.disable()
+            report = io.StringIO()
+            pstats.Stats(self.profile, stream=report).sort_stats("cumulative").print_stats(80)
+            return report.getvalue()
+        finally:
+            _busy = False
+
+
+def create_profile_token(username: str) -> str:
+    expire = datetime.utcnow() + timedelta(seconds=PROFILE_TOKEN_TTL)
+    return jwt.encode({"sub": username, "scope": "profile", "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def check_profile_token(token: str) -> bool:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return False
+    return payload.get("scope") == "profile"
+
+
+class ProfilingMiddleware:
+    """Выполняет запрос с действующим X-Profile под профилировщиком и отдаёт профиль."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = next((value for name, value in scope["headers"] if name == PROFILE_HEADER), None)
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        if not check_profile_token(token.decode()):
+            await PlainTextResponse("Недействительный токен профилирования", status_code=403)(scope, receive, send)
+            return
+        output = headers.get(FORMAT_HEADER, b"pstats").decode()
+        if output not in FORMATS:
+            await PlainTextResponse(f"Формат профиля: {', '.join(FORMATS)}", status_code=400)(scope, receive, send)
+            return
+
+        status = []
+
+        async def capture(message):
+            # Ответ приложения не отправляем, запоминаем только статус
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        profiler = Profiler(output)
+        try:
+            profiler.start()
+        except RuntimeError as exc:
+            await PlainTextResponse(str(exc), status_code=409)(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            report = profiler.stop()
+        response = PlainTextResponse(report, headers={"X-Profile-Status": str(status[0] if status else 500)})
+        await response(scope, receive, send)
+
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile_window(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    output: str = Query("collapsed", alias="format", pattern="^(collapsed|pstats)$"),
+    interval: float = Query(PROFILE_INTERVAL, ge=0.001, le=1),
+    user: User = Depends(current_superuser),
+):
+    """Профиль потока event loop за окно в seconds секунд."""
+    profiler = Profiler(output, interval)
+    try:
+        profiler.start()
+    except RuntimeError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        report = profiler.stop()
+    return report
+
+
+@router.post("/profile/token")
+async def profile_token(user: User = Depends(current_superuser)):
+    """Короткоживущий токен для заголовка X-Profile."""
+    return {"token": create_profile_token(user.username), "expires_in": PROFILE_TOKEN_TTL}
@@ -0,0 +1,135 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import jwt
+from fastapi import HTTPException, Request
+from redis.exceptions import RedisError
+
+from auth.security import SECRET_KEY, ALGORITHM
+from cache import redis
+from config import RATE_LIMIT_LEASE, RATE_LIMIT_LEASE_TTL
+
+# Токен-бакет сразу по нескольким ключам (IP, пользователь) за один вызов.
+# Запрос проходит, только если токен есть во всех бакетах.
+# Клиенту, у которого заполнено больше половины бакета, выдаётся сразу
+# до ARGV[1] токенов впрок, чтобы следующие запросы проверялись без Redis.
+# Возвращает {выданные токены, время ожидания в мс}.
+TOKEN_BUCKET_SCRIPT = """
+local lease = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local ttl = math.ceil(capacity / rate) + 1000
+
+local tokens = {}
+local granted = lease
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local current = tonumber(bucket[1])
+    local ts = tonumber(bucket[2])
+    if current == nil then
+        current = capacity
+    else
+        current = math.min(capacity, current + (now - ts) * rate)
+    end
+    tokens[i] = current
+    if current < 1 then
+        wait = math.max(wait, math.ceil((1 - current) / rate))
+    else
+        local spare = math.floor(current - capacity / 2)
+        granted = math.min(granted, math.max(1, spare))
+    end
+end
+
+if wait > 0 then
+    return {0, wait}
+end
+
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', tokens[i] - granted, 'ts', now)
+    redis.call('PEXPIRE', key, ttl)
+end
+return {granted, 0}
+"""
+
+token_bucket = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+# Токены, выданные воркеру впрок: ключи бакетов -> (остаток, срок годности)
+_leases: OrderedDict = OrderedDict()
+MAX_LEASES = 10000
+
+
+def parse_limit(limit: str):
+    """Разбирает лимит вида "20/60" (20 запросов за 60 секунд)."""
+    count, period = limit.split("/")
+    return int(count), int(period)
+
+
+def _token_subject(request: Request) -> Optional[str]:
+    authorization = request.headers.get("Authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    return payload.get("sub")
+
+
+class RateLimit:
+    """Зависимость FastAPI: ограничивает частоту запросов к маршруту.
+
+    Бакеты ведутся отдельно для IP клиента и для пользователя из токена.
+    При превышении лимита отвечает 429 с заголовком Retry-After.
+    """
+
+    def __init__(self, route: str, limit: str):
+        self.route = route
+        self.capacity, period = parse_limit(limit)
+        # Скорость пополнения в токенах за миллисекунду
+        self.rate = self.capacity / (period * 1000)
+
+    def _keys(self, request: Request):
+        # Все бакеты маршрута под одним {тегом}, чтобы скрипт выполнялся на одном узле
+        keys = [f"rate:{{{self.route}}}:ip:{request.client.host}"]
+        subject = _token_subject(request)
+        if subject:
+            keys.append(f"rate:{{{self.route}}}:user:{subject}")
+        return tuple(keys)
+
+    async def __call__(self, request: Request):
+        keys = self._keys(request)
+
+        lease = _leases.get(keys)
+        if lease is not None:
+            remaining, deadline = lease
+            if remaining > 0 and time.monotonic() < deadline:
+                _leases[keys] = (remaining - 1, deadline)
+                return
+            del _leases[keys]
+
+        try:
+            granted, wait = await token_bucket(
+                keys=list(keys),
+                args=[RATE_LIMIT_LEASE, self.rate, self.capacity],
+            )
+        except RedisError:
+            # Без Redis лимиты не проверяются, чтобы не ронять сервис
+            return
+
+        if not granted:
+            raise HTTPException(
+                status_code=429,
+                detail="Слишком много запросов",
+                headers={"Retry-After": str(max(1, math.ceil(wait / 1000)))},
+            )
+
+        if granted > 1:
+            _leases[keys] = (granted - 1, time.monotonic() + RATE_LIMIT_LEASE_TTL)
+            while len(_leases) > MAX_LEASES:
+                _leases.popitem(last=False)
@@ -0,0 +1,154 @@
+"""Воспроизведение журнала запросов (см. capture.py) с заданным ускорением.
+
+    python replay.py capture.tsv --target http://localhost:8000 --rate 10
+
+Планирование открытое: запрос уходит в момент (ts - ts0) / rate от старта,
+не дожидаясь ответов на предыдущие, поэтому перегрузка сервера видна как
+рост задержек и ошибок, а не как снижение темпа. Если клиент не успевает
+отправить запрос вовремя, это видно по строке "lag отправки".
+
+Параметры, которых нет в журнале (original_url и т.п.), подставляются
+синтетические. Запросы на неизвестные пути ("-") и к /admin пропускаются.
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter, defaultdict
+from typing import NamedTuple
+
+import httpx
+
+
+class Record(NamedTuple):
+    ts: float
+    method: str
+    route: str
+    short_code: str
+
+
+def read_capture(path: str):
+    records = []
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 6:
+                continue
+            ts_ms, method, route, short_code = fields[:4]
+            records.append(Record(int(ts_ms) / 1000, method, route, short_code))
+    records.sort(key=lambda record: record.ts)
+    return records
+
+
+def build_request(record: Record, n: int, token: str = None):
+    """(method, url, params, json, headers) для записи; None — запрос не воспроизводится."""
+    if record.route == "-" or record.route.startswith("/admin"):
+        return None
+    url = record.route.replace("{short_code}", record.short_code)
+    synthetic_url = f"https://replay.example/{n}"
+    params, body = {}, None
+    if record.route in ("/links/shorten", "/links/shorten/time"):
+        params = {"original_url": synthetic_url}
+    elif record.route == "/links/{short_code}/update-url":
+        params = {"new_url": synthetic_url}
+    elif record.route == "/links/url/search":
+        params = {"original_url": synthetic_url}
+    elif record.route == "/links/url/matches":
+        params = {"q": "replay.example"}
+    elif record.route == "/links/stats/batch":
+        body = {"short_codes": [record.short_code]}
+    elif record.route.startswith("/links/bulk/"):
+        return None
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    return record.method, url, params, body, headers
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Report:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.lags = []
+        self.statuses = defaultdict(Counter)
+        self.errors = Counter()
+        self.skipped = 0
+        self.dropped = 0
+        self.elapsed = 0.0
+
+    def print(self):
+        elapsed = self.elapsed
+        total = sum(len(values) for values in self.latencies.values())
+        print(f"отправлено {total} за {elapsed:.1f} с ({total / elapsed if elapsed else 0:.0f} rps), "
+              f"пропущено {self.skipped}, не отправлено (лимит in-flight) {self.dropped}")
+        print(f"{'route':<40} {'n':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}  статусы")
+        for route, values in sorted(self.latencies.items(), key=lambda item: -len(item[1])):
+            values.sort()
+            statuses = " ".join(f"{status}:{n}" for status, n in sorted(self.statuses[route].items()))
+            print(f"{route:<40} {len(values):>7} {percentile(values, 0.5):>8.1f} {percentile(values, 0.9):>8.1f} "
+                  f"{percentile(values, 0.99):>8.1f} {values[-1]:>8.1f}  {statuses}")
+        self.lags.sort()
+        print(f"lag отправки: p50 {percentile(self.lags, 0.5):.1f} ms, p99 {percentile(self.lags, 0.99):.1f} ms")
+        for error, n in self.errors.most_common():
+            print(f"ошибка {error}: {n}")
+
+
+async def send(client: httpx.AsyncClient, report: Report, route: str, request):
+    method, url, params, body, headers = request
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, params=params, json=body, headers=headers)
+    except httpx.HTTPError as exc:
+        report.errors[type(exc).__name__] += 1
+        report.statuses[route]["error"] += 1
+    else:
+        report.statuses[route][response.status_code] += 1
+    report.latencies[route].append((time.perf_counter() - started) * 1000)
+
+
+async def replay(records, target: str, rate: float, token: str, max_inflight: int, timeout: float) -> Report:
+    report = Report()
+    limits = httpx.Limits(max_connections=max_inflight, max_keepalive_connections=max_inflight)
+    async with httpx.AsyncClient(base_url=target, timeout=timeout, limits=limits, follow_redirects=False) as client:
+        inflight = set()
+        start = time.perf_counter()
+        first_ts = records[0].ts if records else 0
+        for n, record in enumerate(records):
+            request = build_request(record, n, token)
+            if request is None:
+                report.skipped += 1
+                continue
+            delay = start + (record.ts - first_ts) / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            report.lags.append(max(0.0, -delay) * 1000)
+            if len(inflight) >= max_inflight:
+                report.dropped += 1
+                continue
+            task = asyncio.create_task(send(client, report, record.route, request))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+        await asyncio.gather(*inflight)
+        report.elapsed = time.perf_counter() - start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение журнала запросов")
+    parser.add_argument("capture", help="файл, записанный с CAPTURE_PATH")
+    parser.add_argument("--target", default="http://localhost:8000")
+    parser.add_argument("--rate", type=float, default=1.0, help="ускорение относительно записи: 1, 10, 0.5 ...")
+    parser.add_argument("--token", help="JWT для запросов, требующих авторизации")
+    parser.add_argument("--max-inflight", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    records = read_capture(args.capture)
+    report = asyncio.run(replay(records, args.target, args.rate, args.token, args.max_inflight, args.timeout))
+    report.print()
+
+
+if __name__ == "__main__":
+    main()
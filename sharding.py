@@ -0,0 +1,235 @@
+"""Шардирование Redis по нескольким узлам консистентным хешированием.
+
+Каждый узел занимает REDIS_VNODES точек на кольце, ключ попадает на
+ближайшую по часовой стрелке точку. При добавлении или удалении узла
+переезжает примерно 1/N ключей. Как и в Redis Cluster, если в ключе есть
+{тег}, хешируется только тег: так связанные ключи оказываются на одном узле.
+"""
+import asyncio
+import bisect
+import hashlib
+from collections import defaultdict
+
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from breaker import CircuitBreaker
+
+
+class RedisUnavailable(RedisError):
+    """Redis не ответил или предохранитель разомкнут."""
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+def hash_slot_key(key: str) -> str:
+    start = key.find("{")
+    if start != -1:
+        end = key.find("}", start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+class HashRing:
+    def __init__(self, nodes, vnodes: int = 160):
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str):
+        i = bisect.bisect(self._hashes, _hash(hash_slot_key(key)))
+        return self._nodes[i % len(self._nodes)]
+
+
+class RedisNode:
+    """Клиент одного узла со своим предохранителем."""
+
+    def __init__(self, url: str, timeout: float, failures: int, reset: float, on_recover=None):
+        self.url = url
+        self.client = aioredis.from_url(
+            url,
+            encoding="utf8",
+            decode_responses=True,
+            socket_timeout=timeout,
+            socket_connect_timeout=timeout,
+        )
+        self.breaker = CircuitBreaker(url, failures, reset, on_recover=on_recover)
+
+    async def call(self, command, *args, **kwargs):
+        if not self.breaker.allow():
+            raise RedisUnavailable(f"{self.url}: circuit open")
+        try:
+            result = await command(*args, **kwargs)
+        except (RedisError, OSError) as exc:
+            self.breaker.record_failure()
+            raise RedisUnavailable(f"{self.url}: {exc}") from exc
+        except BaseException:
+            # Отмена запроса ничего не говорит о здоровье узла, но пробу надо отпустить,
+            # иначе в half_open предохранитель больше не пропустит ни одного вызова
+            self.breaker.release_probe()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def __repr__(self):
+        return f"RedisNode({self.url})"
+
+
+class ShardedRedis:
+    """Подмножество API redis.asyncio.Redis поверх нескольких узлов.
+
+    Команда уходит на узел первого ключа. Ошибки соединения и таймауты
+    превращаются в RedisUnavailable.
+    """
+
+    def __init__(self, urls, vnodes: int, timeout: float, failures: int, reset: float, on_recover=None):
+        self.nodes = {url: RedisNode(url, timeout, failures, reset, on_recover) for url in urls}
+        self.ring = HashRing(self.nodes.values(), vnodes)
+
+    def node(self, key: str) -> RedisNode:
+        return self.ring.node_for(key)
+
+    async def _on_node(self, key: str, name: str, *args, **kwargs):
+        node = self.node(key)
+        return await node.call(getattr(node.client, name), key, *args, **kwargs)
+
+    async def get(self, key, **kwargs):
+        return await self._on_node(key, "get", **kwargs)
+
+    async def set(self, key, value, **kwargs):
+        return await self._on_node(key, "set", value, **kwargs)
+
+    async def incr(self, key):
+        return await self._on_node(key, "incr")
+
+    async def incrby(self, key, amount):
+        return await self._on_node(key, "incrby", amount)
+
+    async def pfcount(self, *keys):
+        """PFCOUNT по нескольким окнам; ключи должны иметь общий {тег}."""
+        return await self._on_node(keys[0], "pfcount", *keys[1:])
+
+    async def zadd(self, key, mapping):
+        return await self._on_node(key, "zadd", mapping)
+
+    async def zrem(self, key, *members):
+        return await self._on_node(key, "zrem", *members)
+
+    async def zcount(self, key, min, max):
+        return await self._on_node(key, "zcount", min, max)
+
+    async def publish(self, channel, message):
+        return await self._on_node(channel, "publish", message)
+
+    def _group(self, keys):
+        groups = defaultdict(list)
+        for i, key in enumerate(keys):
+            groups[self.node(key)].append(i)
+        return groups
+
+    async def delete(self, *keys):
+        groups = self._group(keys)
+        counts = await asyncio.gather(*(
+            node.call(node.client.delete, *(keys[i] for i in positions))
+            for node, positions in groups.items()
+        ))
+        return sum(counts)
+
+    async def mget(self, keys):
+        """MGET с параллельной раздачей по узлам; порядок ответа как у ключей."""
+        keys = list(keys)
+        groups = self._group(keys)
+        answers = await asyncio.gather(*(
+            node.call(node.client.mget, [keys[i] for i in positions])
+            for node, positions in groups.items()
+        ))
+        values = [None] * len(keys)
+        for positions, answer in zip(groups.values(), answers):
+            for i, value in zip(positions, answer):
+                values[i] = value
+        return values
+
+    async def flushall(self):
+        await asyncio.gather(*(node.call(node.client.flushall) for node in self.nodes.values()))
+
+    def pipeline(self, transaction: bool = False):
+        return ShardedPipeline(self)
+
+    def register_script(self, script: str):
+        return ShardedScript(self, script)
+
+    def breakers(self):
+        return [node.breaker.stats() for node in self.nodes.values()]
+
+
+class ShardedPipeline:
+    """Конвейер, который на execute() раскладывает команды по узлам и шлёт их параллельно.
+
+    Команды без ошибок на других узлах выполняются; если упал хотя бы один
+    узел, execute() выбрасывает RedisUnavailable. С raise_on_error=False
+    вместо этого возвращаются все результаты, а на местах команд упавших
+    узлов стоит исключение — так вызывающий код повторит только их.
+    """
+
+    def __init__(self, sharded: ShardedRedis):
+        self.sharded = sharded
+        self.commands = []
+
+    def __getattr__(self, name):
+        def record(key, *args, **kwargs):
+            self.commands.append((self.sharded.node(key), name, key, args, kwargs))
+            return self
+        return record
+
+    def script(self, script: "ShardedScript", keys, args=()):
+        """Ставит вызов Lua-скрипта в конвейер узла первого ключа."""
+        self.commands.append((self.sharded.node(keys[0]), script, keys, args, {}))
+        return self
+
+    async def _execute_on(self, node, commands):
+        pipe = node.client.pipeline(transaction=False)
+        for _, name, key, args, kwargs in commands:
+            if isinstance(name, ShardedScript):
+                await name.scripts[node](keys=key, args=args, client=pipe)
+            else:
+                getattr(pipe, name)(key, *args, **kwargs)
+        return await node.call(pipe.execute)
+
+    async def execute(self, raise_on_error: bool = True):
+        groups = defaultdict(list)
+        for position, command in enumerate(self.commands):
+            groups[command[0]].append((position, command))
+        answers = await asyncio.gather(
+            *(self._execute_on(node, [command for _, command in items]) for node, items in groups.items()),
+            return_exceptions=True,
+        )
+        self.commands = []
+
+        results = [None] * sum(len(items) for items in groups.values())
+        for items, answer in zip(groups.values(), answers):
+            if isinstance(answer, BaseException):
+                if raise_on_error or not isinstance(answer, RedisUnavailable):
+                    raise answer
+                answer = [answer] * len(items)
+            for (position, _), value in zip(items, answer):
+                results[position] = value
+        return results
+
+
+class ShardedScript:
+    """Lua-скрипт, который выполняется на узле первого ключа.
+
+    Все ключи одного вызова должны попадать на один узел (общий {тег}).
+    """
+
+    def __init__(self, sharded: ShardedRedis, script: str):
+        self.sharded = sharded
+        self.scripts = {node: node.client.register_script(script) for node in sharded.nodes.values()}
+
+    async def __call__(self, keys, args=()):
+        node = self.sharded.node(keys[0])
+        return await node.call(self.scripts[node], keys=keys, args=args)
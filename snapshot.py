@@ -0,0 +1,223 @@
+"""Снимок таблицы link для редиректов без Postgres.
+
+Формат файла (little-endian):
+    заголовок   magic(8) | count u64 | max_id u64 | built_at f64 | index_offset u64
+    записи      code_len u16 | url_len u32 | expires i64 | code | url
+    индекс      count * u64 — смещения записей, отсортированных по коду (байтово)
+
+Файл открывается через mmap, поиск идёт бинарным поиском по индексу,
+поэтому читаются только нужные страницы.
+
+Сборка:
+    python snapshot.py build --output links.snap
+    python snapshot.py build --output links.snap --incremental
+"""
+import asyncio
+import calendar
+import heapq
+import mmap
+import os
+import struct
+import time
+from array import array
+from typing import Optional, Tuple
+
+from config import SNAPSHOT_PATH, SNAPSHOT_CHECK_INTERVAL
+
+MAGIC = b"DZSNAP01"
+HEADER = struct.Struct("<8sQQdQ")
+RECORD = struct.Struct("<HIq")
+OFFSET = struct.Struct("<Q")
+
+
+class Snapshot:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.max_id, self.built_at, self.index_offset = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"{path}: не файл снимка")
+
+    def _offset(self, i: int) -> int:
+        return OFFSET.unpack_from(self.mm, self.index_offset + i * OFFSET.size)[0]
+
+    def _record(self, offset: int):
+        code_len, url_len, expires = RECORD.unpack_from(self.mm, offset)
+        start = offset + RECORD.size
+        return start, code_len, url_len, expires
+
+    def _code_at(self, i: int) -> bytes:
+        start, code_len, _, _ = self._record(self._offset(i))
+        return self.mm[start:start + code_len]
+
+    def lookup(self, short_code: str) -> Optional[Tuple[str, int]]:
+        """Возвращает (original_url, expires) или None; expires == 0 — без срока."""
+        target = short_code.encode()
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._code_at(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.count:
+            return None
+        start, code_len, url_len, expires = self._record(self._offset(lo))
+        if self.mm[start:start + code_len] != target:
+            return None
+        url_start = start + code_len
+        return self.mm[url_start:url_start + url_len].decode(), expires
+
+    def __iter__(self):
+        for i in range(self.count):
+            start, code_len, url_len, expires = self._record(self._offset(i))
+            code = self.mm[start:start + code_len]
+            url = self.mm[start + code_len:start + code_len + url_len]
+            yield code, url, expires
+
+    def close(self):
+        self.mm.close()
+
+
+_snapshot: Optional[Snapshot] = None
+_checked_at = 0.0
+
+
+def get_snapshot() -> Optional[Snapshot]:
+    """Текущий снимок; подменённый на диске файл переоткрывается на лету."""
+    global _snapshot, _checked_at
+    now = time.monotonic()
+    if _snapshot is not None and now - _checked_at < SNAPSHOT_CHECK_INTERVAL:
+        return _snapshot
+    _checked_at = now
+
+    try:
+        stat = os.stat(SNAPSHOT_PATH)
+    except FileNotFoundError:
+        return _snapshot
+    if _snapshot is None or (stat.st_ino, stat.st_mtime_ns) != (_snapshot.stat.st_ino, _snapshot.stat.st_mtime_ns):
+        previous, _snapshot = _snapshot, Snapshot(SNAPSHOT_PATH)
+        if previous is not None:
+            previous.close()
+    return _snapshot
+
+
+def lookup_url(short_code: str) -> Optional[str]:
+    """URL для редиректа из снимка; просроченные ссылки не отдаются."""
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    found = snapshot.lookup(short_code)
+    if found is None:
+        return None
+    original_url, expires = found
+    if expires and expires <= time.time():
+        return None
+    return original_url
+
+
+def write_snapshot(path: str, records, max_id: int) -> int:
+    """Записывает отсортированные по коду записи (code, url, expires) и атомарно подменяет файл."""
+    tmp_path = f"{path}.tmp"
+    offsets = array("Q")
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+        position = HEADER.size
+        for code, url, expires in records:
+            offsets.append(position)
+            chunk = RECORD.pack(len(code), len(url), expires) + code + url
+            f.write(chunk)
+            position += len(chunk)
+        index_offset = position
+        offsets.tofile(f)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(offsets), max_id, time.time(), index_offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(offsets)
+
+
+async def _fetch_links(min_id: int):
+    from sqlalchemy import text
+
+    from auth.database import engine
+
+    # Архивные ссылки тоже редиректят (см. archive.py), поэтому входят в снимок.
+    # id в link и link_archive общие: при архивации строка переносится со своим id
+    query = text(
+        'SELECT id, short_code, original_url, expires_at FROM link '
+        'WHERE id > :min_id AND short_code IS NOT NULL AND original_url IS NOT NULL '
+        'UNION ALL '
+        'SELECT id, short_code, original_url, expires_at FROM link_archive '
+        'WHERE id > :min_id AND short_code IS NOT NULL AND original_url IS NOT NULL '
+        'ORDER BY short_code COLLATE "C"'
+    )
+    rows = []
+    max_id = min_id
+    async with engine.connect() as conn:
+        result = await conn.stream(query, {"min_id": min_id})
+        async for link_id, code, url, expires_at in result:
+            max_id = max(max_id, link_id)
+            expires = calendar.timegm(expires_at.utctimetuple()) if expires_at else 0
+            rows.append((code.encode(), url.encode(), expires))
+    await engine.dispose()
+    return rows, max_id
+
+
+def _merge(old: Snapshot, new_rows):
+    """Сливает старый снимок с новыми строками; при совпадении кода побеждает новая."""
+    previous = None
+    merged = heapq.merge(
+        ((code, 1, url, expires) for code, url, expires in new_rows),
+        ((code, 2, url, expires) for code, url, expires in old),
+    )
+    for code, _, url, expires in merged:
+        if code != previous:
+            yield code, url, expires
+            previous = code
+
+
+def build(path: str, incremental: bool = False) -> int:
+    old = Snapshot(path) if incremental and os.path.exists(path) else None
+    rows, max_id = asyncio.run(_fetch_links(old.max_id if old else 0))
+    records = _merge(old, rows) if old else iter(rows)
+    count = write_snapshot(path, records, max_id)
+    if old:
+        old.close()
+    return count
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Снимок таблицы link для редиректов без БД")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="собрать снимок из Postgres")
+    build_parser.add_argument("--output", default=SNAPSHOT_PATH)
+    build_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="дописать только ссылки, созданные после прошлой сборки "
+             "(изменения и удаления старых ссылок попадают только в полную сборку)",
+    )
+
+    lookup_parser = commands.add_parser("lookup", help="найти короткий код в снимке")
+    lookup_parser.add_argument("--input", default=SNAPSHOT_PATH)
+    lookup_parser.add_argument("short_code")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        started = time.perf_counter()
+        count = build(args.output, args.incremental)
+        print(f"{args.output}: {count} ссылок за {time.perf_counter() - started:.2f} с")
+    else:
+        print(Snapshot(args.input).lookup(args.short_code))
+
+
+if __name__ == "__main__":
+    main()
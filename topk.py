@@ -0,0 +1,93 @@
+"""Топ рефереров и стран по ссылке алгоритмом Space-Saving.
+
+На каждую ссылку и срез хранится не больше TOPK_SIZE счётчиков (ZSET) и
+ошибки вытеснения (HASH). Новое значение при полном наборе вытесняет
+значение с минимальным счётчиком и наследует его счётчик как ошибку.
+
+Гарантии при N переходах по ссылке и k = TOPK_SIZE:
+    * count завышен не больше чем на error, а error <= N / k;
+    * любое значение, встречавшееся больше N / k раз, есть в наборе;
+    * count - error — нижняя граница настоящего числа переходов.
+Память — O(k) на ссылку и срез независимо от числа переходов.
+"""
+from typing import Optional
+from urllib.parse import urlsplit
+
+from cache import redis
+from config import TOPK_SIZE
+
+DIMENSIONS = ("ref", "country")
+
+# Пачка увеличений одного среза: ARGV = k, значение1, n1, значение2, n2, ...
+SPACE_SAVING_SCRIPT = """
+local k = tonumber(ARGV[1])
+for i = 2, #ARGV, 2 do
+    local item = ARGV[i]
+    local n = tonumber(ARGV[i + 1])
+    if redis.call('ZSCORE', KEYS[1], item) then
+        redis.call('ZINCRBY', KEYS[1], n, item)
+    elseif redis.call('ZCARD', KEYS[1]) < k then
+        redis.call('ZADD', KEYS[1], n, item)
+    else
+        local victim = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+        local floor = tonumber(victim[2])
+        redis.call('ZREM', KEYS[1], victim[1])
+        redis.call('HDEL', KEYS[2], victim[1])
+        redis.call('ZADD', KEYS[1], floor + n, item)
+        redis.call('HSET', KEYS[2], item, floor)
+    end
+end
+return 0
+"""
+
+space_saving = redis.register_script(SPACE_SAVING_SCRIPT)
+
+
+def topk_keys(short_code: str, dimension: str):
+    """Ключи счётчиков и ошибок; код ссылки — {тег}, оба ключа на одном узле."""
+    return [f"top:{{{short_code}}}:{dimension}", f"top:{{{short_code}}}:{dimension}:err"]
+
+
+def referrer_host(referrer: Optional[str]) -> str:
+    """Хост реферера без порта; "direct" для переходов без Referer."""
+    if not referrer:
+        return "direct"
+    try:
+        host = urlsplit(referrer).hostname
+    except ValueError:
+        # Заголовок присылает клиент: "http://[" и подобное не разбираются
+        return "unknown"
+    return host[:255] if host else "unknown"
+
+
+def country_code(value: Optional[str]) -> str:
+    value = (value or "").strip().upper()
+    return value if len(value) == 2 and value.isalpha() else "XX"
+
+
+def add_counts(pipe, counts):
+    """Ставит в конвейер обновления для {(код, срез): {значение: n}}."""
+    for (short_code, dimension), items in counts.items():
+        args = [TOPK_SIZE]
+        for item, n in items.items():
+            args.extend((item, n))
+        pipe.script(space_saving, topk_keys(short_code, dimension), args)
+
+
+async def get_top(short_code: str, limit: int = 10):
+    """Топ значений по каждому срезу: [{"value", "count", "error"}], по убыванию count."""
+    pipe = redis.pipeline(transaction=False)
+    for dimension in DIMENSIONS:
+        counters, errors = topk_keys(short_code, dimension)
+        pipe.zrevrange(counters, 0, limit - 1, withscores=True)
+        pipe.hgetall(errors)
+    answers = await pipe.execute()
+
+    top = {}
+    for i, dimension in enumerate(DIMENSIONS):
+        entries, errors = answers[2 * i], answers[2 * i + 1]
+        top[dimension] = [
+            {"value": value, "count": int(count), "error": int(errors.get(value, 0))}
+            for value, count in entries
+        ]
+    return top
@@ -0,0 +1,218 @@
+"""Счётчики использования по владельцам ссылок.
+
+owner_usage хранит число ссылок (включая архивные) и сумму переходов по ним.
+Счётчики меняются в той же транзакции, что и сами ссылки: при создании,
+удалении и сбросе пачки переходов (clicks.py). Сроки действия ссылок лежат в
+Redis ZSET usage_exp:{owner_id} (score — expires_at), число просроченных —
+ZCOUNT по текущему времени.
+
+Сверка (reconcile_usage) периодически пересчитывает всё по link и
+link_archive и исправляет расхождения, например от переходов, потерянных
+при падении воркера. Она идёт пачками владельцев и блокирует только их
+строки owner_usage, поэтому остальные владельцы работают без ожидания.
+Однократный запуск:
+    python usage.py
+"""
+import asyncio
+import calendar
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth.database import async_session_maker
+from cache import redis, RedisUnavailable
+from config import USAGE_RECONCILE_INTERVAL, USAGE_RECONCILE_BATCH
+
+logger = logging.getLogger(__name__)
+
+ADD_LINKS_SQL = text(
+    "INSERT INTO owner_usage (owner_id, links, clicks) VALUES (:owner_id, :links, 0) "
+    "ON CONFLICT (owner_id) DO UPDATE SET links = owner_usage.links + excluded.links"
+)
+
+REMOVE_LINKS_SQL = text(
+    "UPDATE owner_usage SET links = links - :links, clicks = clicks - :clicks WHERE owner_id = :owner_id"
+)
+
+GET_USAGE_SQL = text("SELECT links, clicks FROM owner_usage WHERE owner_id = :owner_id")
+
+RECONCILE_LOCK_SQL = text("SELECT pg_try_advisory_xact_lock(hashtext('owner_usage'))")
+
+# Владельцы со ссылками, но без строки счётчиков, получают нулевую строку:
+# её, как и остальные, исправит пересчёт под блокировкой
+MISSING_OWNERS_SQL = text("""
+INSERT INTO owner_usage (owner_id, links, clicks)
+SELECT DISTINCT owner_id, 0, 0 FROM (
+    SELECT owner_id FROM link
+    UNION ALL
+    SELECT owner_id FROM link_archive
+) AS all_links
+WHERE owner_id IS NOT NULL
+ON CONFLICT (owner_id) DO NOTHING
+""")
+
+# Строки блокируются в порядке owner_id, как и при сбросе переходов (clicks.py)
+LOCK_OWNERS_SQL = text(
+    "SELECT owner_id FROM owner_usage WHERE owner_id > :after ORDER BY owner_id LIMIT :batch FOR UPDATE"
+)
+
+# Выполняется отдельным запросом после LOCK_OWNERS_SQL: в READ COMMITTED его
+# снимок берётся уже после блокировки и видит все изменения, записанные до неё,
+# а незавершённые транзакции сами прибавят свою дельту после сверки
+RECONCILE_SQL = text("""
+WITH actual AS (
+    SELECT o.owner_id, count(l.owner_id) AS links, coalesce(sum(l.visits), 0) AS clicks
+    FROM unnest(CAST(:owners AS integer[])) AS o(owner_id)
+    LEFT JOIN (
+        SELECT owner_id, visits FROM link
+        UNION ALL
+        SELECT owner_id, visits FROM link_archive
+    ) AS l ON l.owner_id = o.owner_id
+    GROUP BY o.owner_id
+)
+UPDATE owner_usage SET links = actual.links, clicks = actual.clicks
+FROM actual
+WHERE owner_usage.owner_id = actual.owner_id
+AND (owner_usage.links, owner_usage.clicks) IS DISTINCT FROM (actual.links, actual.clicks)
+""")
+
+EXPIRING_SQL = text("""
+SELECT owner_id, short_code, expires_at FROM link WHERE owner_id IS NOT NULL AND expires_at IS NOT NULL
+UNION ALL
+SELECT owner_id, short_code, expires_at FROM link_archive WHERE owner_id IS NOT NULL AND expires_at IS NOT NULL
+ORDER BY owner_id
+""")
+
+OWNERS_SQL = text("SELECT owner_id FROM owner_usage")
+
+
+def expiry_key(owner_id: int) -> str:
+    return f"usage_exp:{owner_id}"
+
+
+def _timestamp(value: datetime) -> int:
+    return calendar.timegm(value.utctimetuple())
+
+
+async def add_links(db: AsyncSession, owner_id: Optional[int], count: int = 1):
+    """Учитывает новые ссылки; выполняется в транзакции вставки, до commit."""
+    if owner_id is not None:
+        await db.execute(ADD_LINKS_SQL, {"owner_id": owner_id, "links": count})
+
+
+async def remove_links(db: AsyncSession, owner_id: Optional[int], count: int, clicks: int):
+    """Вычитает удалённые ссылки и их переходы; выполняется в транзакции удаления."""
+    if owner_id is not None and count:
+        await db.execute(REMOVE_LINKS_SQL, {"owner_id": owner_id, "links": count, "clicks": clicks})
+
+
+async def track_expiry(owner_id: Optional[int], short_code: str, expires_at: Optional[datetime]):
+    if owner_id is None or expires_at is None:
+        return
+    try:
+        await redis.zadd(expiry_key(owner_id), {short_code: _timestamp(expires_at)})
+    except RedisUnavailable:
+        # Сверка восстановит запись
+        pass
+
+
+async def untrack_expiry(owner_id: Optional[int], short_codes):
+    short_codes = list(short_codes)
+    if owner_id is None or not short_codes:
+        return
+    try:
+        await redis.zrem(expiry_key(owner_id), *short_codes)
+    except RedisUnavailable:
+        pass
+
+
+async def get_usage(db: AsyncSession, owner_id: int) -> dict:
+    row = (await db.execute(GET_USAGE_SQL, {"owner_id": owner_id})).one_or_none()
+    links, clicks = (row.links, row.clicks) if row else (0, 0)
+    try:
+        expired = await redis.zcount(expiry_key(owner_id), "-inf", int(time.time()))
+    except RedisUnavailable:
+        expired = None
+    return {
+        "links": links,
+        "clicks": clicks,
+        "active_links": links - expired if expired is not None else None,
+        "expired_links": expired,
+    }
+
+
+async def _rebuild_expiries(session: AsyncSession):
+    owners = {}
+    result = await session.stream(EXPIRING_SQL)
+    async for owner_id, short_code, expires_at in result:
+        owners.setdefault(owner_id, {})[short_code] = _timestamp(expires_at)
+    # Владельцы, у которых ссылок со сроком не осталось: их наборы просто удаляются
+    empty = [owner_id for owner_id in (await session.execute(OWNERS_SQL)).scalars() if owner_id not in owners]
+
+    pipe = redis.pipeline(transaction=False)
+    for owner_id, members in owners.items():
+        pipe.delete(expiry_key(owner_id))
+        pipe.zadd(expiry_key(owner_id), members)
+    for owner_id in empty:
+        pipe.delete(expiry_key(owner_id))
+    await pipe.execute()
+
+
+async def _reconcile_batch(session: AsyncSession, after: int):
+    """Сверяет пачку владельцев после after; (последний owner_id, исправлено) или None в конце."""
+    owners = (await session.execute(LOCK_OWNERS_SQL, {"after": after, "batch": USAGE_RECONCILE_BATCH})).scalars().all()
+    if not owners:
+        return None
+    result = await session.execute(RECONCILE_SQL, {"owners": owners})
+    return owners[-1], result.rowcount
+
+
+async def reconcile_usage() -> bool:
+    """Пересчитывает owner_usage и сроки ссылок; False, если сверку уже ведёт другой воркер."""
+    async with async_session_maker() as session:
+        if not (await session.execute(RECONCILE_LOCK_SQL)).scalar():
+            return False
+        await session.execute(MISSING_OWNERS_SQL)
+        await session.commit()
+
+        after, corrected = 0, 0
+        while True:
+            # Каждая пачка — своя короткая транзакция, блокировки строк держатся недолго
+            if not (await session.execute(RECONCILE_LOCK_SQL)).scalar():
+                return False
+            batch = await _reconcile_batch(session, after)
+            await session.commit()
+            if batch is None:
+                break
+            after, rowcount = batch
+            corrected += rowcount
+        if corrected:
+            logger.info("owner usage corrected", extra={"owners": corrected})
+        try:
+            await _rebuild_expiries(session)
+        except RedisUnavailable:
+            logger.warning("owner usage expiries not rebuilt: redis unavailable")
+    return True
+
+
+async def run_usage_reconciler():
+    """Фоновая задача: периодическая сверка счётчиков."""
+    while True:
+        await asyncio.sleep(USAGE_RECONCILE_INTERVAL)
+        try:
+            await reconcile_usage()
+        except Exception:
+            logger.exception("owner usage reconciliation failed")
+
+
+def main():
+    asyncio.run(reconcile_usage())
+    print("счётчики владельцев пересчитаны")
+
+
+if __name__ == "__main__":
+    main()